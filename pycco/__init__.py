@@ -1,3 +1,6 @@
+__version__ = "0.3.1"
+
 from .main import *
+from .builder import Pycco
 
-__all__ = ("process",)
+__all__ = ("process", "Pycco")
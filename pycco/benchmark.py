@@ -0,0 +1,211 @@
+"""
+Benchmarks for each stage of the Pycco pipeline.
+
+Synthetic sources are generated for every language in `pycco.main.languages`,
+in several sizes and in comment-heavy and code-heavy shapes, and the time
+taken to `parse`, `highlight`, `markdown` (preprocessing and rendering the
+comments), `generate_html` and `process` them end to end is measured
+separately. Run it with
+
+    python -m pycco.benchmark --save baseline.json
+
+and later check a change against that baseline with
+
+    python -m pycco.benchmark --compare baseline.json
+
+which exits with an error if any stage got slower than the threshold allows.
+"""
+from __future__ import print_function
+
+import json
+import optparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from pycco import main as pycco
+
+try:
+    timer = time.perf_counter
+except AttributeError:
+    timer = time.time
+
+# The number of lines in each size of generated source.
+SIZES = {"small": 200, "medium": 2000, "huge": 20000}
+
+# How many lines of comments there are for every line of code, in each shape.
+SHAPES = {"comments": (4, 1), "code": (1, 6)}
+
+STAGES = ("parse", "highlight", "markdown", "generate_html", "process")
+
+# By default a stage has regressed if it is more than this much slower than
+# its baseline, and by more than `MIN_DIFFERENCE` seconds, so that timer noise
+# on the fastest stages does not count.
+THRESHOLD = 0.25
+MIN_DIFFERENCE = 0.001
+
+
+def extension(language):
+    """The file extension for one of the entries of `languages`."""
+    for ext, l in pycco.languages.items():
+        if l is language:
+            return ext
+
+
+def generate_source(language, lines, shape="code"):
+    """
+    Generate roughly `lines` lines of source for `language`, alternating blocks
+    of comments and code in the proportions given by `shape`. Languages with
+    multi-line comments get some of those too.
+    """
+
+    docs, code = SHAPES[shape]
+    symbol = language["symbol"]
+    multistart, multiend = language.get("multistart"), language.get("multiend")
+    out = []
+    block = 0
+    while len(out) < lines:
+        if multistart and block % 3 == 2:
+            out.append(multistart)
+            for i in range(docs):
+                out.append("Block {} explains *step* {} of the `process`.".format(block, i))
+            out.append(multiend)
+        else:
+            out.append("{} === Section {} ===".format(symbol, block))
+            for i in range(docs - 1):
+                out.append("{} Comment {} on block {}, see [[other.py]].".format(symbol, i, block))
+        for i in range(code):
+            out.append("value_{0}_{1} = compute({0}, {1}) + \"text {{{0}}}\"".format(block, i))
+        block += 1
+    return "\n".join(out) + "\n"
+
+
+def best_time(func, repeat):
+    """
+    The fastest of `repeat` runs of `func`, in seconds, after an untimed run to
+    warm up any caches which live for the whole process.
+    """
+    func()
+    best = None
+    for _ in range(repeat):
+        start = timer()
+        func()
+        elapsed = timer() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def benchmark_source(language, code, repeat=3):
+    """Time every stage of documenting `code`, returning seconds per stage."""
+
+    ext = extension(language)
+    workdir = tempfile.mkdtemp()
+    try:
+        source = os.path.join(workdir, "bench" + ext)
+        outdir = os.path.join(workdir, "docs")
+        with open(source, "wb") as f:
+            f.write(code.encode("utf-8"))
+
+        sections = pycco.parse(code, language)
+        highlighted = pycco.highlight(sections, language, outdir=outdir)
+        divided = language["divider_text"].join(
+            section["code_text"].rstrip() for section in sections)
+
+        def render_docs():
+            pycco.markdown_cache.clear()
+            for section in sections:
+                pycco.markdown(pycco.preprocess(section["docs_text"], outdir=outdir))
+
+        stages = {
+            "parse": lambda: pycco.parse(code, language),
+            "highlight": lambda: pycco.highlight_code(divided, language),
+            "markdown": render_docs,
+            "generate_html": lambda: pycco.generate_html(source, highlighted,
+                                                         outdir=outdir),
+            "process": lambda: list(pycco.process_iter([source], outdir=outdir,
+                                                       force=True)),
+        }
+        return dict((stage, best_time(stages[stage], repeat)) for stage in STAGES)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def run(languages=None, sizes=None, shapes=None, repeat=3, out=None):
+    """
+    Benchmark every combination of language, size and shape, returning the
+    seconds taken by each stage keyed by `"<language>/<size>/<shape>"`.
+    """
+
+    results = {}
+    for ext, language in sorted(pycco.languages.items()):
+        if languages and language["name"] not in languages:
+            continue
+        for size in sizes or sorted(SIZES, key=SIZES.get):
+            for shape in shapes or sorted(SHAPES):
+                name = "/".join((language["name"], size, shape))
+                code = generate_source(language, SIZES[size], shape)
+                results[name] = benchmark_source(language, code, repeat)
+                if out:
+                    print("{:<32}".format(name) + "".join(
+                        "{:>16.4f}".format(results[name][stage]) for stage in STAGES),
+                        file=out)
+    return results
+
+
+def compare(results, baseline, threshold=THRESHOLD):
+    """
+    List the `(name, stage, baseline, result)` of every stage which is more
+    than `threshold` slower than its baseline.
+    """
+
+    regressions = []
+    for name, stages in sorted(results.items()):
+        for stage, seconds in sorted(stages.items()):
+            before = baseline.get(name, {}).get(stage)
+            if before is not None and seconds > before * (1 + threshold) \
+               and seconds - before > MIN_DIFFERENCE:
+                regressions.append((name, stage, before, seconds))
+    return regressions
+
+
+def main():
+    parser = optparse.OptionParser(usage="python -m pycco.benchmark [options]")
+    parser.add_option('-l', '--language', action='append', dest='languages',
+                      help='Only benchmark this language (may be repeated)')
+    parser.add_option('-s', '--size', action='append', dest='sizes',
+                      choices=sorted(SIZES),
+                      help='Only benchmark this size of source (may be repeated)')
+    parser.add_option('--shape', action='append', dest='shapes',
+                      choices=sorted(SHAPES),
+                      help='Only benchmark this shape of source (may be repeated)')
+    parser.add_option('-r', '--repeat', action='store', type='int', default=3,
+                      help='Keep the best of this many runs of each stage')
+    parser.add_option('--save', action='store', type='string',
+                      help='Write the results to this JSON file')
+    parser.add_option('--compare', action='store', type='string',
+                      help='Fail if any stage is slower than in this JSON baseline')
+    parser.add_option('--threshold', action='store', type='float', default=THRESHOLD,
+                      help='The slowdown allowed by --compare, as a fraction')
+    opts, args = parser.parse_args()
+
+    print("{:<32}".format("benchmark") + "".join("{:>16}".format(s) for s in STAGES))
+    results = run(opts.languages, opts.sizes, opts.shapes, opts.repeat, out=sys.stdout)
+
+    if opts.save:
+        with open(opts.save, "w") as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+
+    if opts.compare:
+        with open(opts.compare) as f:
+            regressions = compare(results, json.load(f), opts.threshold)
+        for name, stage, before, after in regressions:
+            print("pycco: {} {} regressed from {:.4f}s to {:.4f}s".format(
+                name, stage, before, after))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+A Pycco you can keep around.
+
+Programs which document files over and over, like a docs pipeline or an
+editor plugin, can create a `Pycco` once with their options, and then call
+`render()` for the HTML of a single file, or `build()` to document a set of
+files into the output directory:
+
+    docs = Pycco(outdir="docs", preserve_paths=False)
+    html = docs.render("src/example.py")
+    docs.build(["src/example.py", "src/other.py"])
+
+Lexers, the compiled template, the Markdown converter and the render caches
+are shared by every `Pycco` in a process. All of the caches are bounded, so a
+`Pycco` can stay alive for as long as the process does; `clear_caches()`
+frees their memory and `stats()` tells how well they work. Rendering uses
+shared state, so it is serialized with a lock and a `Pycco` can be used from
+any thread.
+"""
+
+import threading
+import time
+
+from pycco import main as pycco
+
+# Rendering goes through the shared Markdown converter and caches, so only one
+# thread renders at a time.
+render_lock = threading.RLock()
+
+
+class Pycco(object):
+
+    """
+    Documents files with a fixed set of options, which are those of
+    `pycco.main.process()`. `granular` highlighting is on by default, since a
+    long-lived `Pycco` usually sees the same files again after small edits.
+    """
+
+    def __init__(self, outdir=None, preserve_paths=True, language=None,
+                 encoding="utf8", jobs=1, cache_dir=None, index=None,
+                 granular=True, page_size=None, compress=False):
+        if not outdir:
+            raise TypeError("Missing the required 'outdir' keyword argument.")
+        if language is not None and language not in pycco.languages_by_name:
+            raise ValueError("Unknown forced language: " + language)
+        self.outdir = outdir
+        self.preserve_paths = preserve_paths
+        self.language = language
+        self.encoding = encoding
+        self.jobs = jobs
+        self.cache_dir = cache_dir
+        self.index = index
+        self.granular = granular
+        self.page_size = page_size
+        self.compress = compress
+        self.languages = pycco.languages
+        self.reset_stats()
+
+    def warm(self, languages=None):
+        """
+        Load Markdown, Pygments and the template, and build the lexers of
+        `languages`, given by name, or of the forced language, so that the
+        first file rendered is not slower than the rest.
+        """
+        names = languages or ([self.language] if self.language else [])
+        with render_lock:
+            pycco.get_template()
+            pycco.markdown("")
+            for name in names:
+                pycco.get_lexer(pycco.languages_by_name[name])
+
+    def render(self, path_or_text, name=None):
+        """
+        Render a single page and return its HTML, without writing anything.
+        `path_or_text` is the path of a source file to read or, if `name` is
+        given, the text of a source, which is documented as the file `name`.
+        """
+
+        if name is None:
+            name = path_or_text
+            with open(name, "rb") as f:
+                code = f.read().decode(self.encoding)
+        else:
+            code = path_or_text
+
+        start = time.time()
+        with render_lock:
+            html = pycco._generate_documentation(
+                name, code, self.outdir, self.preserve_paths, self.language,
+                cache_dir=self.cache_dir, index=self.index,
+                granular=self.granular)
+        self._count(time.time() - start, rendered=1, bytes=len(html))
+        return html.decode("utf-8")
+
+    def build(self, sources, force=False):
+        """
+        Document `sources` into the output directory, like `process()` does
+        but without printing anything, and return the `ProcessResult` of each
+        of them, in sorted order. With `force`, unchanged sources are rendered
+        again too.
+        """
+
+        start = time.time()
+        with render_lock:
+            results = list(pycco.build_iter(
+                sources, preserve_paths=self.preserve_paths, outdir=self.outdir,
+                language=self.language, encoding=self.encoding, jobs=self.jobs,
+                force=force, cache_dir=self.cache_dir, index=self.index,
+                granular=self.granular, compress=self.compress,
+                page_size=self.page_size))
+
+        rendered = [result for result in results if not result.skipped]
+        self._count(time.time() - start, rendered=len(rendered),
+                    skipped=len(results) - len(rendered),
+                    bytes=sum(result.size for result in rendered))
+        return results
+
+    def clear_caches(self):
+        """
+        Forget every rendered comment, highlighted section, detected language
+        and lexer, in every `Pycco` of this process. The disk cache, if any,
+        is left alone.
+        """
+        from pycco import detect
+        with render_lock:
+            pycco.markdown_cache.clear()
+            pycco.section_cache.clear()
+            detect.detect_cache.clear()
+            for language in pycco.languages.values():
+                language.pop("lexer", None)
+
+    def stats(self):
+        """
+        Describe the work done by this `Pycco` since it was created, or since
+        `reset_stats()`, along with the `CacheInfo` of each of the shared
+        caches.
+        """
+        from pycco import detect
+        stats = dict(self._stats)
+        stats["markdown_cache"] = pycco.markdown_cache.info()
+        stats["section_cache"] = pycco.section_cache.info()
+        stats["detect_cache"] = detect.detect_cache.info()
+        stats["lexers"] = sum(1 for language in pycco.languages.values()
+                              if "lexer" in language)
+        return stats
+
+    def reset_stats(self):
+        self._stats = {"rendered": 0, "skipped": 0, "bytes": 0, "seconds": 0.0}
+
+    def _count(self, seconds, **counts):
+        with render_lock:
+            self._stats["seconds"] += seconds
+            for key, value in counts.items():
+                self._stats[key] += value
@@ -0,0 +1,244 @@
+"""
+Caches shared by the different stages of a Pycco build.
+"""
+
+import collections
+import hashlib
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+
+from pycco.compat import pycco_replace
+
+# A snapshot of a cache's statistics, in the spirit of `functools.lru_cache`.
+CacheInfo = collections.namedtuple(
+    "CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+
+class LRUCache(object):
+
+    """
+    A bounded mapping that forgets its least recently used entries first, and
+    counts its hits and misses so that it can be sized sensibly.
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = self.misses = 0
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Look up `key`, marking it as recently used."""
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data[key] = value
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """Store `value` under `key`, evicting the oldest entries if needed."""
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        """Forget every entry and reset the statistics."""
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+    def info(self):
+        return CacheInfo(self.hits, self.misses, self.maxsize, len(self._data))
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+
+# Matches the version in the source of Pygments' package.
+version_matcher = re.compile(r'^__version__\s*=\s*[\'"]([^\'"]+)[\'"]', re.M)
+
+# The Pygments version found by `pygments_version()`.
+_pygments_version = None
+
+
+def pygments_version():
+    """
+    The version of Pygments. Unless Pygments has already been imported, it is
+    read from the source of the package instead, so that a build whose code
+    all comes from the cache never loads it.
+    """
+
+    global _pygments_version
+    if _pygments_version is None:
+        if "pygments" in sys.modules:
+            _pygments_version = sys.modules["pygments"].__version__
+        else:
+            try:
+                from importlib.util import find_spec
+                origin = find_spec("pygments").origin
+            except ImportError:
+                import imp
+                origin = os.path.join(imp.find_module("pygments")[1],
+                                      "__init__.py")
+            try:
+                with open(origin, "rb") as f:
+                    match = version_matcher.search(f.read().decode("utf-8"))
+            except (IOError, OSError, TypeError):
+                match = None
+            if match:
+                _pygments_version = match.group(1)
+            else:
+                import pygments
+                _pygments_version = pygments.__version__
+    return _pygments_version
+
+
+def highlight_key(language, code):
+    """
+    The `DiskCache` key of the highlighted fragments of `code`, which is in the
+    language named `language`.
+    """
+    from pycco import __version__
+    return (__version__, pygments_version(), language, code)
+
+
+class DiskCache(object):
+
+    """
+    A content-addressed cache of JSON values in a directory, shared between
+    runs and between processes.
+
+    Each entry lives in its own file named after the hash of its key. Entries
+    are written to a temporary file and renamed into place, so readers only
+    ever see complete entries, and any entry that cannot be read is treated as
+    a miss. Reading an entry refreshes its modification time, which `evict()`
+    uses to drop the least recently used entries once the cache outgrows
+    `max_size` bytes.
+
+    The size of the cache is kept in a `USAGE_NAME` file at its top: the total
+    found by the last `evict()` that looked through the cache, followed by the
+    size of each entry written since, one per line. `evict()` only looks
+    through the whole cache once that adds up to more than `max_size`.
+    """
+
+    USAGE_NAME = "usage"
+
+    def __init__(self, directory, max_size=256 * 1024 * 1024):
+        self.directory = directory
+        self.max_size = max_size
+        self.usage = os.path.join(directory, self.USAGE_NAME)
+
+    def path(self, key):
+        """The file holding the entry for `key`, a sequence of strings."""
+        digest = hashlib.sha1(u"\0".join(key).encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest[2:] + ".json")
+
+    def get(self, key, default=None):
+        filename = self.path(key)
+        try:
+            with open(filename, "rb") as f:
+                value = json.loads(f.read().decode("utf-8"))
+            os.utime(filename, None)
+        except (IOError, OSError, ValueError):
+            return default
+        return value
+
+    def put(self, key, value):
+        filename = self.path(key)
+        directory = os.path.dirname(filename)
+        try:
+            os.makedirs(directory)
+        except OSError:
+            pass
+
+        data = json.dumps(value).encode("utf-8")
+        fd, temp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            pycco_replace(temp, filename)
+        except (IOError, OSError):
+            # Another process may be cleaning up underneath us; the entry will
+            # simply be computed again next time.
+            try:
+                os.remove(temp)
+            except OSError:
+                pass
+            return
+
+        # Lines appended in one write are not mixed up with those of other
+        # processes. Until `evict()` has counted the cache, there is nothing
+        # to add to.
+        try:
+            fd = os.open(self.usage, os.O_WRONLY | os.O_APPEND)
+        except OSError:
+            return
+        try:
+            os.write(fd, "{}\n".format(len(data)).encode("ascii"))
+        finally:
+            os.close(fd)
+
+    def size(self):
+        """
+        The size of the cache as recorded in its usage file, or `None` if it
+        has not been counted. Entries which were written again are counted
+        twice, so this errs on the side of evicting too early.
+        """
+        try:
+            with open(self.usage, "rb") as f:
+                return sum(int(line) for line in f.read().split())
+        except (IOError, OSError, ValueError):
+            return None
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache fits in
+        `max_size` bytes. Nothing is done while the usage file says that it
+        already does.
+        """
+        recorded = self.size()
+        if recorded is not None and recorded <= self.max_size:
+            return
+
+        entries = []
+        total = 0
+        for root, dirs, files in os.walk(self.directory):
+            for name in files:
+                filename = os.path.join(root, name)
+                if filename == self.usage:
+                    continue
+                try:
+                    stat = os.stat(filename)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, filename))
+                total += stat.st_size
+
+        entries.sort()
+        for mtime, size, filename in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+            total -= size
+
+        if os.path.isdir(self.directory):
+            fd, temp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write("{}\n".format(total).encode("ascii"))
+            pycco_replace(temp, self.usage)
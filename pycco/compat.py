@@ -9,3 +9,39 @@ try:
 except AttributeError:
     import itertools
     pycco_zip_longest = itertools.izip_longest
+
+import os
+try:
+    pycco_replace = os.replace
+except AttributeError:
+    def pycco_replace(src, dst):
+        # Python 2 can only overwrite with `rename` on POSIX systems.
+        if os.name == "nt" and os.path.exists(dst):
+            os.remove(dst)
+        os.rename(src, dst)
+
+try:
+    import socketserver as pycco_socketserver
+except ImportError:
+    import SocketServer as pycco_socketserver
+
+try:
+    import queue as pycco_queue
+except ImportError:
+    import Queue as pycco_queue
+
+try:
+    pycco_scandir = os.scandir
+except AttributeError:
+    class _DirEntry(object):
+        def __init__(self, directory, name):
+            self.name = name
+            self.path = os.path.join(directory, name)
+
+        def is_dir(self, follow_symlinks=True):
+            if not follow_symlinks and os.path.islink(self.path):
+                return False
+            return os.path.isdir(self.path)
+
+    def pycco_scandir(directory="."):
+        return [_DirEntry(directory, name) for name in os.listdir(directory)]
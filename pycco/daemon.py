@@ -0,0 +1,295 @@
+"""
+A resident Pycco process for editor integrations. Running `pycco --serve` keeps
+an interpreter alive with its lexers, compiled template and render caches
+warm, listening on a local Unix socket; `pycco --client file.py` hands the
+work to it instead of paying for start-up on every save.
+
+Each connection carries a single request, encoded as one line of JSON, and is
+answered with one or more lines of JSON. A request names a `source`, relative
+to the client's `cwd`, and the usual `outdir`, `preserve_paths`, `language`,
+`encoding` and `cache_dir` options. The daemon writes the page and answers
+with its `destination`, or answers with the `html` itself when `write` is
+false.
+
+A request may name several `sources` instead, which are built like `process()`
+does, taking the `force`, `jobs`, `compress` and `page_size` options as well.
+Links are resolved against every file of the `project`, which defaults to the
+`sources` themselves. The daemon
+answers with the `source`, `destination` and whether it was `skipped` of each
+of them as soon as its page is written, then with a last line saying it is
+`done`. Failures are answered with an `error`, which ends the answer.
+"""
+from __future__ import print_function
+
+import json
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+from os import path
+
+from pycco.main import (_generate_documentation, build_index, build_iter,
+                        destination, write_file, write_stylesheet)
+from pycco.compat import pycco_socketserver
+
+# Shut down after this many seconds without a request.
+IDLE_TIMEOUT = 600
+
+
+def default_socket_path():
+    """The socket used when none is given: one per user, in the temp dir."""
+    user = os.getuid() if hasattr(os, "getuid") else os.environ.get("USERNAME", "")
+    return path.join(tempfile.gettempdir(), "pycco-{}.sock".format(user))
+
+
+class RequestHandler(pycco_socketserver.StreamRequestHandler):
+
+    """Answers a single JSON request read from the connection."""
+
+    def handle(self):
+        self.server.begin()
+        try:
+            try:
+                message = json.loads(self.rfile.readline().decode("utf-8"))
+                if "sources" in message:
+                    responses = self.server.build(message)
+                else:
+                    responses = [self.server.respond(message)]
+                for response in responses:
+                    self.reply(response)
+            except Exception as e:
+                self.reply({"error": "{}: {}".format(type(e).__name__, e)})
+        finally:
+            self.server.end()
+
+    def reply(self, response):
+        self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+        self.wfile.flush()
+
+
+class DaemonServer(pycco_socketserver.ThreadingMixIn,
+                   pycco_socketserver.UnixStreamServer):
+
+    """
+    A threaded Unix socket server which renders requests one at a time, since
+    the Markdown converter and caches are shared, while reading and writing
+    files concurrently. It keeps track of when it was last busy.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, socket_path):
+        pycco_socketserver.UnixStreamServer.__init__(self, socket_path,
+                                                     RequestHandler)
+        self.render_lock = threading.Lock()
+        self._activity_lock = threading.Lock()
+        self._active = 0
+        self._last_activity = time.time()
+
+    def begin(self):
+        with self._activity_lock:
+            self._active += 1
+
+    def end(self):
+        with self._activity_lock:
+            self._active -= 1
+            self._last_activity = time.time()
+
+    def idle_for(self, seconds):
+        """Whether no request has been running for the last `seconds`."""
+        with self._activity_lock:
+            return not self._active \
+                and time.time() - self._last_activity >= seconds
+
+    def respond(self, message):
+        cwd = message.get("cwd") or os.getcwd()
+        source = message["source"]
+        outdir = path.join(cwd, message.get("outdir") or "docs")
+        preserve_paths = message.get("preserve_paths", True)
+        encoding = message.get("encoding") or "utf8"
+
+        with open(path.join(cwd, source), "rb") as f:
+            code = f.read().decode(encoding)
+
+        with self.render_lock:
+            html = _generate_documentation(
+                source, code, outdir, preserve_paths, message.get("language"),
+                cache_dir=message.get("cache_dir"), granular=True)
+
+        if not message.get("write", True):
+            return {"source": source, "html": html.decode("utf-8")}
+
+        dest = destination(source, preserve_paths=preserve_paths,
+                           outdir=outdir)
+        write_file(dest, html)
+        write_stylesheet(outdir)
+
+        return {"source": source, "destination": dest}
+
+    def build(self, message):
+        """
+        Build the `sources` of a request like `process()` does, yielding the
+        response for each of them as soon as its page is written. Sources are
+        relative to the client's directory, which the daemon works in while
+        it renders them.
+        """
+        cwd = message.get("cwd") or os.getcwd()
+        outdir = message.get("outdir") or "docs"
+        preserve_paths = message.get("preserve_paths", True)
+        language = message.get("language")
+        encoding = message.get("encoding") or "utf8"
+        page_size = message.get("page_size")
+
+        with self.render_lock:
+            previous = os.getcwd()
+            os.chdir(cwd)
+            try:
+                index = build_index(
+                    sorted(message.get("project") or message["sources"]),
+                    preserve_paths=preserve_paths, outdir=outdir,
+                    language=language, encoding=encoding,
+                    page_size=page_size)
+                for result in build_iter(
+                        message["sources"], outdir=outdir,
+                        preserve_paths=preserve_paths, language=language,
+                        encoding=encoding, jobs=message.get("jobs", 1),
+                        force=message.get("force", False),
+                        cache_dir=message.get("cache_dir"), index=index,
+                        granular=True, compress=message.get("compress", False),
+                        page_size=page_size):
+                    yield {"source": result.source,
+                           "destination": result.destination,
+                           "skipped": result.skipped}
+            finally:
+                os.chdir(previous)
+        yield {"done": True}
+
+
+def serve(socket_path=None, idle_timeout=IDLE_TIMEOUT):
+    """
+    Run the daemon until it has been idle for `idle_timeout` seconds, or until
+    the user hits Ctrl-C.
+    """
+
+    socket_path = socket_path or default_socket_path()
+    if path.exists(socket_path):
+        try:
+            _connect(socket_path).close()
+        except socket.error:
+            # Left behind by a daemon which did not shut down cleanly.
+            os.remove(socket_path)
+        else:
+            raise RuntimeError("A pycco daemon is already listening on " + socket_path)
+
+    server = DaemonServer(socket_path)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    print("pycco: serving on {}".format(socket_path))
+
+    try:
+        while not server.idle_for(idle_timeout):
+            time.sleep(min(1, idle_timeout))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        server.server_close()
+        try:
+            os.remove(socket_path)
+        except OSError:
+            pass
+
+
+def _connect(socket_path):
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path)
+    except socket.error:
+        client.close()
+        raise
+    return client
+
+
+def responses(message, socket_path=None):
+    """
+    Send a single request to the daemon and yield each line of its answer as
+    it arrives. Raises `socket.error` if no daemon is listening, and
+    `ValueError` if a line of the answer is not valid JSON, as happens when
+    the daemon dies halfway through it.
+    """
+
+    client = _connect(socket_path or default_socket_path())
+    try:
+        client.sendall(json.dumps(message).encode("utf-8") + b"\n")
+        client.shutdown(socket.SHUT_WR)
+        reply = client.makefile("rb")
+        try:
+            for line in reply:
+                yield json.loads(line.decode("utf-8"))
+        finally:
+            reply.close()
+    finally:
+        client.close()
+
+
+def request(message, socket_path=None):
+    """
+    Send a single request to the daemon and return its response. Raises
+    `socket.error` if no daemon is listening, and `ValueError` if there is no
+    valid response.
+    """
+
+    for response in responses(message, socket_path):
+        return response
+    raise ValueError("The pycco daemon closed the connection without answering")
+
+
+def client(sources, opts, project=None):
+    """
+    Have the daemon document `sources`, using the command line options in
+    `opts`, and resolve their links against the sources of `project`, if
+    they are only part of it. Returns the sources it did not document, so that they can be
+    documented here instead: all of them if no daemon is running, and those
+    it did not get to if it fails or its answer is cut short.
+    """
+
+    sources = sorted(sources)
+    if not sources:
+        return []
+    done = set()
+    skipped = 0
+    try:
+        for response in responses({
+                "cwd": os.getcwd(),
+                "sources": sources,
+                "outdir": opts.outdir,
+                "preserve_paths": opts.paths,
+                "language": opts.language,
+                "cache_dir": opts.cache_dir and path.abspath(opts.cache_dir),
+                "force": bool(opts.force),
+                "jobs": opts.jobs,
+                "compress": bool(opts.compress),
+                "page_size": opts.page_size,
+                "project": sorted(project) if project else sources,
+        }, opts.socket or default_socket_path()):
+            if "error" in response:
+                print("pycco: daemon: {}".format(response["error"]),
+                      file=sys.stderr)
+                break
+            if response.get("done"):
+                break
+            done.add(response["source"])
+            if response["skipped"]:
+                skipped += 1
+            else:
+                print("pycco = {} -> {}".format(response["source"],
+                                                response["destination"]))
+    except (socket.error, ValueError, KeyError, TypeError, AttributeError):
+        pass
+
+    if skipped:
+        print("pycco: skipped {} unchanged file(s)".format(skipped))
+    return [source for source in sources if source not in done]
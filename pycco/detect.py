@@ -0,0 +1,185 @@
+"""
+Working out the language of a source whose extension Pycco does not know.
+
+Sources are recognised, in order, by:
+
+ * their shebang line, like `#!/usr/bin/env python3`;
+ * a Vim or Emacs modeline, like `# vim: set ft=ruby:` or `-*- mode: lua -*-`,
+   in their first or last five lines;
+ * the exact file names Pygments associates with each language, like
+   `SConstruct` for Python or `Rakefile` for Ruby;
+ * as a last resort, asking the lexers of the languages Pycco supports how
+   much the first `GUESS_PREFIX_SIZE` characters look like their language.
+
+The file names come from Pygments' list of lexers, which is read without
+importing every lexer module. Pygments' extensions are not used, since many of
+them, like `.t` or `.h`, are shared between languages or too short to be
+trusted; a source with an extension Pycco does not know is recognised by its
+contents instead. Only the lexers of Pycco's own languages are ever asked to
+guess. Results are remembered for each path and
+hash of the text they were worked out from.
+"""
+
+import hashlib
+import os
+import re
+from os import path
+
+from pycco import main as pycco
+from pycco import trace
+from pycco.cache import LRUCache
+
+# Only this much of the start of a source is looked at when guessing.
+GUESS_PREFIX_SIZE = 4096
+
+DETECT_CACHE_SIZE = 4096
+detect_cache = LRUCache(DETECT_CACHE_SIZE)
+
+# Interpreters which are not also the name of a Pygments lexer, mapped to the
+# language they run. Version numbers are stripped from interpreters first, so
+# `python3.11` is looked up as `python`.
+INTERPRETERS = {
+    "node": "javascript",
+    "nodejs": "javascript",
+    "pypy": "python",
+    "runghc": "haskell",
+    "runhaskell": "haskell",
+    "escript": "erlang",
+    "tclsh": "tcl",
+    "wish": "tcl",
+    "guile": "scheme",
+    "csi": "scheme",
+    "luajit": "lua",
+    "sqlite": "sql",
+}
+
+shebang_matcher = re.compile(r'#!\s*(\S+)(.*)')
+version_matcher = re.compile(r'[-.\d]+$')
+vim_matcher = re.compile(
+    r'\b(?:vi|vim|ex)(?:[<=>]?\d*)?:.*?\b(?:ft|filetype|syntax)=([\w+-]+)')
+emacs_matcher = re.compile(r'-\*-.*?\bmode:\s*([\w+-]+)', re.I)
+emacs_short_matcher = re.compile(r'-\*-\s*([\w+-]+)\s*-\*-')
+
+# The tables built by `index()`.
+_index = None
+
+
+def index():
+    """
+    Map the aliases and exact file names Pygments knows for each of Pycco's
+    languages to that language.
+    """
+
+    global _index
+    if _index is None:
+        from pygments.lexers import get_all_lexers
+        try:
+            lexers = list(get_all_lexers(plugins=False))
+        except TypeError:
+            lexers = list(get_all_lexers())
+
+        ours = dict((l["name"], l) for l in pycco.languages.values())
+        aliases, filenames = {}, {}
+        for name, lexer_aliases, lexer_filenames, _ in lexers:
+            matches = [ours[alias] for alias in lexer_aliases if alias in ours]
+            if not matches:
+                continue
+            language = matches[0]
+            for alias in lexer_aliases:
+                aliases.setdefault(alias, language)
+            for pattern in lexer_filenames:
+                if not any(c in pattern for c in "*?["):
+                    filenames.setdefault(pattern, language)
+
+        for interpreter, name in INTERPRETERS.items():
+            if name in ours:
+                aliases.setdefault(interpreter, ours[name])
+        _index = (aliases, filenames)
+    return _index
+
+
+def by_filename(source):
+    """The language Pygments associates with the file name of `source`, if any."""
+
+    return index()[1].get(path.basename(source))
+
+
+def by_shebang(line):
+    """The language of the interpreter named on a shebang `line`, if any."""
+
+    m = shebang_matcher.match(line)
+    if not m:
+        return None
+    interpreter = os.path.basename(m.group(1))
+    if interpreter == "env":
+        # Skip the options and variable assignments `env` may be given.
+        args = [arg for arg in m.group(2).split()
+                if not arg.startswith("-") and "=" not in arg]
+        if not args:
+            return None
+        interpreter = os.path.basename(args[0])
+    aliases = index()[0]
+    return aliases.get(interpreter) \
+        or aliases.get(version_matcher.sub("", interpreter))
+
+
+def by_modeline(lines):
+    """The language named by a Vim or Emacs modeline in `lines`, if any."""
+
+    aliases = index()[0]
+    for line in lines:
+        for matcher in (vim_matcher, emacs_matcher, emacs_short_matcher):
+            m = matcher.search(line)
+            if m and m.group(1).lower() in aliases:
+                return aliases[m.group(1).lower()]
+
+
+def lexer_class(language):
+    """The Pygments lexer class of a language, without instantiating it."""
+    try:
+        from pygments.lexers import find_lexer_class_by_name
+    except ImportError:
+        return type(pycco.get_lexer(language))
+    return find_lexer_class_by_name(language["name"])
+
+
+def guess(text):
+    """
+    The language whose lexer rates `text` highest, or `None` if none of them
+    recognises it at all.
+    """
+
+    best, best_score = None, 0.0
+    for language in sorted(pycco.languages.values(), key=lambda l: l["name"]):
+        score = lexer_class(language).analyse_text(text)
+        if score > best_score:
+            best, best_score = language, score
+    return best
+
+
+def detect_language(source, code):
+    """
+    Work out the language of `source`, whose contents are `code`, returning
+    `None` if it cannot be recognised.
+    """
+
+    code = code or ""
+    head = code[:GUESS_PREFIX_SIZE]
+    tail = code[max(len(head), len(code) - 1024):]
+    digest = hashlib.sha1((head + "\0" + tail).encode("utf-8", "surrogatepass"))
+    key = (source, digest.hexdigest())
+    detected = detect_cache.get(key, detect_cache)
+    if detected is not detect_cache:
+        return detected
+
+    lines = head.split("\n", 5)[:5] + (tail or head).split("\n")[-5:]
+    detected = by_shebang(lines[0]) \
+        or by_modeline(lines) \
+        or (source and by_filename(source)) \
+        or None
+    if detected is None:
+        with trace.span("guess_lexer", source):
+            detected = guess(head)
+
+    detect_cache.put(key, detected)
+    return detected
@@ -0,0 +1,196 @@
+"""
+Finding the sources to document.
+
+Besides files, `pycco` accepts directories, which are searched recursively
+for every file with an extension listed in `pycco.main.languages`, and glob
+patterns such as `src/**/*.py`, which are expanded by Pycco itself so that
+huge trees never have to fit on a command line. Hidden files and
+directories are skipped while searching.
+
+Exclude patterns follow the rules of `.gitignore` files: a pattern without a
+slash matches a name at any depth, one with a slash is anchored, a trailing
+slash only matches directories, `**` matches any number of directories and a
+leading `!` includes again what an earlier pattern excluded. Patterns given
+with `--exclude` are matched against paths as Pycco reports them, and those
+read from a file given with `--exclude-from` against paths relative to the
+file's directory, just like a `.gitignore`. Excluded directories are never
+entered.
+"""
+
+import os
+import re
+from os import path
+
+from pycco.compat import pycco_scandir
+
+# Matches the characters which make a path a glob pattern.
+glob_matcher = re.compile(r"[*?[]")
+
+
+def pattern_to_regex(pattern):
+    """
+    Translate a glob pattern into a regular expression matching whole
+    `/`-separated paths. `*`, `?` and `[...]` never match a slash, while `**`
+    matches any number of directories.
+    """
+
+    out = []
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        if pattern.startswith("**/", i):
+            out.append("(?:.*/)?")
+            i += 3
+            continue
+        elif pattern.startswith("**", i):
+            out.append(".*")
+            i += 2
+            continue
+        elif c == "*":
+            out.append("[^/]*")
+        elif c == "?":
+            out.append("[^/]")
+        elif c == "[" and pattern.find("]", i + 2) > 0:
+            end = pattern.find("]", i + 2)
+            chars = pattern[i + 1:end].replace("\\", "\\\\")
+            if chars.startswith("!"):
+                chars = "^" + chars[1:]
+            elif chars.startswith("^"):
+                chars = "\\" + chars
+            out.append("[" + chars + "]")
+            i = end + 1
+            continue
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return re.compile("".join(out) + r"\Z")
+
+
+class Excludes(object):
+
+    """
+    A list of gitignore-style exclude patterns. The last pattern matching a
+    path decides whether it is excluded.
+    """
+
+    def __init__(self, patterns=(), files=()):
+        self.rules = []
+        for pattern in patterns:
+            self.add(pattern)
+        for filename in files:
+            self.read(filename)
+
+    def add(self, pattern, base=None):
+        """
+        Add a pattern, matched against paths relative to the directory `base`
+        or, without one, against paths as they are reported.
+        """
+        pattern = pattern.strip()
+        if not pattern or pattern.startswith("#"):
+            return
+        negate = pattern.startswith("!")
+        if negate:
+            pattern = pattern[1:]
+        dir_only = pattern.endswith("/")
+        pattern = pattern.rstrip("/")
+        if "/" in pattern:
+            pattern = pattern.lstrip("/")
+        else:
+            pattern = "**/" + pattern
+        if base is not None:
+            base = path.abspath(base).replace(os.sep, "/").rstrip("/") + "/"
+        self.rules.append((pattern_to_regex(pattern), negate, dir_only, base))
+
+    def read(self, filename):
+        """Add every pattern in a `.gitignore`-style file."""
+        base = path.dirname(path.abspath(filename))
+        with open(filename) as f:
+            for line in f:
+                self.add(line, base=base)
+
+    def excluded(self, filename, is_dir=False):
+        """Whether the file, or directory if `is_dir` is set, is excluded."""
+        if not self.rules:
+            return False
+        name = filename.replace(os.sep, "/")
+        absolute = None
+        result = False
+        for regex, negate, dir_only, base in self.rules:
+            if result == (not negate) or dir_only and not is_dir:
+                continue
+            if base is None:
+                relative = name
+            else:
+                if absolute is None:
+                    absolute = path.abspath(filename).replace(os.sep, "/")
+                if not absolute.startswith(base):
+                    continue
+                relative = absolute[len(base):]
+            if regex.match(relative):
+                result = not negate
+        return result
+
+
+def walk(top, excludes, extensions=None, matcher=None, max_depth=None):
+    """
+    Yield the files under the directory `top` which have one of `extensions`,
+    if given, and are matched by the compiled `matcher`, if given, leaving out
+    hidden and excluded files and never entering hidden or excluded
+    directories, or going deeper than `max_depth` directories.
+    """
+
+    stack = [(top, 0)]
+    while stack:
+        directory, depth = stack.pop()
+        prefix = "" if directory == "." else path.join(directory, "")
+        try:
+            entries = list(pycco_scandir(directory))
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.name.startswith("."):
+                continue
+            name = prefix + entry.name
+            if entry.is_dir(follow_symlinks=False):
+                if (max_depth is None or depth < max_depth) \
+                   and not excludes.excluded(name, True):
+                    stack.append((name, depth + 1))
+            elif (extensions is None or path.splitext(entry.name)[1] in extensions) \
+                    and (matcher is None or matcher.match(name.replace(os.sep, "/"))) \
+                    and not excludes.excluded(name):
+                yield name
+
+
+def expand_glob(pattern, excludes, extensions=None):
+    """Yield the files matching the glob `pattern`, like `walk()`."""
+
+    parts = pattern.replace(os.sep, "/").split("/")
+    fixed = 0
+    while fixed < len(parts) - 1 and not glob_matcher.search(parts[fixed]):
+        fixed += 1
+    top = "/".join(parts[:fixed]) or ("/" if pattern.startswith("/") else ".")
+    max_depth = None if "**" in pattern else len(parts) - fixed - 1
+
+    matcher = pattern_to_regex(path.normpath(pattern).replace(os.sep, "/"))
+    return walk(path.normpath(top), excludes, extensions, matcher, max_depth)
+
+
+def find_sources(paths, exclude=(), exclude_from=(), extensions=None):
+    """
+    Expand the directories and glob patterns in `paths` into a sorted list of
+    sources, leaving out those matching the `exclude` patterns or the patterns
+    in the `exclude_from` files. Only files with one of `extensions` are found
+    in directories and by patterns; files named explicitly are always kept,
+    as are paths which do not exist, so that they are reported later on.
+    """
+
+    excludes = Excludes(exclude or (), exclude_from or ())
+    sources = set()
+    for name in paths:
+        if path.isdir(name):
+            sources.update(walk(path.normpath(name), excludes, extensions))
+        elif not path.exists(name) and glob_matcher.search(name):
+            sources.update(expand_glob(name, excludes, extensions))
+        else:
+            sources.add(name)
+    return sorted(sources)
@@ -36,24 +36,33 @@ Or, to install the latest source
 
 # This module contains all of our static resources.
 import pycco_resources
-
-# Import our external dependencies.
+from pycco import trace
+from pycco.cache import DiskCache, LRUCache, highlight_key, pygments_version
+from pycco.compat import pycco_queue, pycco_replace
+
+# Import our external dependencies. Markdown, Pygments and Pystache are slow to
+# import, so they are only loaded by the functions that render something; that
+# keeps `pycco --help` and importing this module fast.
+import collections
+import functools
+import hashlib
+import itertools
+import json
+import multiprocessing
 import optparse
 import os
-import pygments
-import pystache
 import re
 import sys
+import threading
 import time
-from markdown import markdown
 from os import path
-from pygments import lexers, formatters
 
 # === Main Documentation Generation Functions ===
 
 
 def generate_documentation(source, outdir=None, preserve_paths=True,
-                           language=None, encoding="utf8"):
+                           language=None, encoding="utf8", cache_dir=None,
+                           index=None, granular=False):
     """
     Generate the documentation for a source file by reading it in, splitting it
     up into comment/code sections, highlighting them for the appropriate
@@ -62,74 +71,192 @@ def generate_documentation(source, outdir=None, preserve_paths=True,
 
     if not outdir:
         raise TypeError("Missing the required 'outdir' keyword argument.")
-    code = open(source, "rb").read().decode(encoding)
-    return _generate_documentation(source, code, outdir, preserve_paths, language)
+    with trace.span("read", source):
+        code = open(source, "rb").read().decode(encoding)
+    return _generate_documentation(source, code, outdir, preserve_paths, language,
+                                   cache_dir=cache_dir, index=index,
+                                   granular=granular)
 
 
-def _generate_documentation(file_path, code, outdir, preserve_paths, language):
+def _generate_documentation(file_path, code, outdir, preserve_paths, language,
+                            cache_dir=None, index=None, granular=False):
     """
     Helper function to allow documentation generation without file handling.
     """
-    language = get_language(file_path, code, language=language)
-    sections = parse(code, language)
-    highlighted = highlight(sections, language, preserve_paths=preserve_paths, outdir=outdir)
-    return generate_html(file_path, highlighted, preserve_paths=preserve_paths, outdir=outdir)
+    with trace.span("get_language", file_path):
+        language = get_language(file_path, code, language=language)
+    with trace.span("parse", file_path):
+        sections = parse(code, language)
+    highlighted = highlight(sections, language, preserve_paths=preserve_paths,
+                            outdir=outdir, cache_dir=cache_dir, index=index,
+                            granular=granular)
+    with trace.span("template", file_path):
+        return generate_html(file_path, highlighted, preserve_paths=preserve_paths,
+                             outdir=outdir)
+
+
+# Matches an encoding declaration, which is dropped from Python sources.
+coding_matcher = re.compile(r'coding[:=]\s*([-\w.]+)')
+
+# Matches the indentation at the start of a line.
+indent_matcher = re.compile(r"\s*")
+
+
+class Section(object):
+
+    """
+    A comment and the code that follows it. `parse()` fills in the raw
+    `docs_text` and `code_text`, and `highlight()` returns copies which also
+    have the rendered `docs_html` and `code_html` and the section's `num`.
+
+    Big files have tens of thousands of sections, so their fields are kept in
+    slots rather than a dictionary. They can still be read and set like the
+    keys of a dictionary, which is what sections used to be; only the fields
+    which have been set count as keys.
+    """
+
+    __slots__ = ("docs_text", "code_text", "docs_html", "code_html", "num")
+
+    def __init__(self, docs_text, code_text, **rendered):
+        self.docs_text = docs_text
+        self.code_text = code_text
+        for key, value in rendered.items():
+            self[key] = value
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self.__slots__ and hasattr(self, key)
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def keys(self):
+        return [key for key in self.__slots__ if hasattr(self, key)]
+
+    def items(self):
+        return [(key, getattr(self, key)) for key in self.keys()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __eq__(self, other):
+        if isinstance(other, (Section, dict)):
+            return dict(self.items()) == dict(other.items())
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "Section({})".format(", ".join(
+            "{}={!r}".format(key, value) for key, value in self.items()))
 
 
 def parse(code, language):
     """
     Given a string of source code, parse out each comment and the code that
-    follows it, and create an individual **section** for it.
-    Sections take the form:
-        { "docs_text": ...,
-          "docs_html": ...,
-          "code_text": ...,
-          "code_html": ...,
-          "num":       ...
-        }
+    follows it, and create an individual **section** for it, as a `Section`.
+
+    The text of the current section is gathered up as lists of lines and only
+    joined when the section is saved, so parsing takes time linear in the
+    length of the source.
     """
 
-    lines = code.split("\n")
-    sections = []
-    has_code = docs_text = code_text = ""
+    return list(parse_iter(code.split("\n"), language))
 
-    if lines[0].startswith("#!"):
-        lines.pop(0)
+
+def parse_iter(lines, language, max_size=None):
+    """
+    Parse an iterable of lines, without their line breaks, yielding each
+    section as soon as it is complete. Only the current section is held in
+    memory, so `lines` can be streamed from a file of any size. With
+    `max_size`, code growing past that many characters is cut at the end of a
+    line and carried on in a section without docs, so that even a source with
+    no comments at all is never held whole.
+    """
+
+    # Look at the first few lines for a shebang and an encoding declaration.
+    lines = iter(lines)
+    head = list(itertools.islice(lines, 3))
+    start = 0
+
+    if head[0].startswith("#!"):
+        start = 1
 
     if language["name"] == "python":
-        for linenum, line in enumerate(lines[:2]):
-            if re.search(r'coding[:=]\s*([-\w.]+)', lines[linenum]):
-                lines.pop(linenum)
+        for linenum in range(start, min(start + 2, len(head))):
+            if coding_matcher.search(head[linenum]):
+                del head[linenum]
                 break
 
-    def save(docs, code):
-        if docs or code:
-            sections.append({
-                "docs_text": docs,
-                "code_text": code
-            })
+    # Sections are saved here as they are completed, and yielded after each
+    # line.
+    sections = []
+
+    # The lines of documentation and code in the current section. `has_docs`
+    # tracks whether the docs contain anything besides whitespace and
+    # `decorated` whether the code starts with a decorator; `None` means that
+    # the code is still blank.
+    docs_lines = []
+    code_lines = []
+    code_size = 0
+    has_code = has_docs = False
+    decorated = None
+
+    def save(code_text):
+        docs_text = "".join(docs_lines)
+        if docs_text or code_text:
+            sections.append(Section(docs_text, code_text))
+
+    def add_docs(text):
+        docs_lines.append(text)
+        return has_docs or bool(text.strip())
 
     # Setup the variables to get ready to check for multiline comments
     multi_line = False
     multi_string = False
     multistart, multiend = language.get("multistart"), language.get("multiend")
     comment_matcher = language['comment_matcher']
+    delimiters = (multistart, multiend)
+    declarations = ('class ', 'def ', '@')
 
-    for line in lines:
+    for line in itertools.chain(head[start:], lines):
         process_as_code = False
+        comment = None
+        lstripped = line.lstrip()
+
         # Only go into multiline comments section when one of the delimiters is
         # found to be at the start of a line
         if multistart and multiend \
-           and any(line.lstrip().startswith(delim) or line.rstrip().endswith(delim)
-                   for delim in (multistart, multiend)):
+           and any(lstripped.startswith(delim) or line.rstrip().endswith(delim)
+                   for delim in delimiters):
             multi_line = not multi_line
+            stripped = line.strip()
 
             if multi_line \
-               and line.strip().endswith(multiend) \
-               and len(line.strip()) > len(multiend):
+               and stripped.endswith(multiend) \
+               and len(stripped) > len(multiend):
                 multi_line = False
 
-            if not line.strip().startswith(multistart) and not multi_line \
+            if not stripped.startswith(multistart) and not multi_line \
                or multi_string:
 
                 process_as_code = True
@@ -145,48 +272,79 @@ def parse(code, language):
                 # docs
                 line = line.replace(multistart, '')
                 line = line.replace(multiend, '')
-                docs_text += line.strip() + '\n'
-                indent_level = re.match("\s*", line).group(0)
+                has_docs = add_docs(line.strip() + '\n')
+                indent = " " * len(indent_matcher.match(line).group(0))
 
-                if has_code and docs_text.strip():
-                    save(docs_text, code_text[:-1])
-                    code_text = code_text.split('\n')[-1]
-                    has_code = docs_text = ''
+                if has_code and has_docs:
+                    save("".join(code_lines)[:-1])
+                    del docs_lines[:], code_lines[:]
+                    code_size = 0
+                    has_code = has_docs = False
+                    decorated = None
 
         elif multi_line:
             # Remove leading spaces
-            if re.match(r' {{{:d}}}'.format(len(indent_level)), line):
-                docs_text += line[len(indent_level):] + '\n'
+            if line.startswith(indent):
+                has_docs = add_docs(line[len(indent):] + '\n')
             else:
-                docs_text += line + '\n'
-
-        elif re.match(comment_matcher, line):
-            if has_code:
-                save(docs_text, code_text)
-                has_code = docs_text = code_text = ''
-            docs_text += re.sub(comment_matcher, "", line) + "\n"
+                has_docs = add_docs(line + '\n')
 
         else:
-            process_as_code = True
+            comment = comment_matcher.match(line)
+            if comment:
+                if has_code:
+                    save("".join(code_lines))
+                    del docs_lines[:], code_lines[:]
+                    code_size = 0
+                    has_code = has_docs = False
+                    decorated = None
+                has_docs = add_docs(line[comment.end():] + "\n")
+            else:
+                process_as_code = True
 
         if process_as_code:
-            if code_text and any(line.lstrip().startswith(x)
-                                 for x in ['class ', 'def ', '@']):
-                if not code_text.lstrip().startswith("@"):
-                    save(docs_text, code_text)
-                    code_text = has_code = docs_text = ''
+            if code_lines and lstripped.startswith(declarations):
+                if not decorated:
+                    save("".join(code_lines))
+                    del docs_lines[:], code_lines[:]
+                    code_size = 0
+                    has_code = has_docs = False
+                    decorated = None
 
             has_code = True
-            code_text += line + '\n'
+            code_lines.append(line + '\n')
+            code_size += len(line) + 1
+            if decorated is None and lstripped:
+                decorated = lstripped.startswith('@')
+            if max_size and code_size >= max_size:
+                save("".join(code_lines))
+                del docs_lines[:], code_lines[:]
+                code_size = 0
+                has_code = has_docs = False
+
+        if sections:
+            for section in sections:
+                yield section
+            del sections[:]
+
+    save("".join(code_lines))
+    for section in sections:
+        yield section
 
-    save(docs_text, code_text)
+# === Preprocessing the comments ===
 
-    return sections
+# Matches a comment which declares a section, like `=== this ===`.
+section_matcher = re.compile(r'^([=]+)([^=]+)[=]*\s*$')
 
-# === Preprocessing the comments ===
+# Matches a cross-reference, like `[[main.py#section]]`.
+crossref_matcher = re.compile(r'(?<!`)\[\[(.+?)\]\]')
 
 
-def preprocess(comment, preserve_paths=True, outdir=None):
+def sanitize_section_name(name):
+    return "-".join(name.lower().strip().split(" "))
+
+
+def preprocess(comment, preserve_paths=True, outdir=None, index=None):
     """
     Add cross-references before having the text processed by markdown.  It's
     possible to reference another file, like this : `[[main.py]]` which renders
@@ -195,31 +353,30 @@ def preprocess(comment, preserve_paths=True, outdir=None):
     [[main.py#highlighting-the-source-code]]. Sections have to be manually
     declared; they are written on a single line, and surrounded by equals signs:
     `=== like this ===`
+
+    If a `CrossrefIndex` of the project is given, references to the files in it
+    are looked up there instead of being worked out every time.
     """
 
     if not outdir:
         raise TypeError("Missing the required 'outdir' keyword argument.")
 
-    def sanitize_section_name(name):
-        return "-".join(name.lower().strip().split(" "))
+    def link(name, anchor=None):
+        href = index.href(name, anchor) if index is not None else None
+        if href is None:
+            href = path.basename(destination(name,
+                                             preserve_paths=preserve_paths,
+                                             outdir=outdir))
+        return href
 
     def replace_crossref(match):
         # Check if the match contains an anchor
         if '#' in match.group(1):
             name, anchor = match.group(1).split('#')
-            return " [{}]({}#{})"\
-                .format(name,
-                        path.basename(destination(name,
-                                                  preserve_paths=preserve_paths,
-                                                  outdir=outdir)),
-                        anchor)
+            return " [{}]({}#{})".format(name, link(name, anchor), anchor)
 
         else:
-            return " [{}]({})"\
-                .format(match.group(1),
-                        path.basename(destination(match.group(1),
-                                                  preserve_paths=preserve_paths,
-                                                  outdir=outdir)))
+            return " [{}]({})".format(match.group(1), link(match.group(1)))
 
     def replace_section_name(match):
         """
@@ -231,11 +388,137 @@ def preprocess(comment, preserve_paths=True, outdir=None):
             name=match.group(2)
         )
 
-    comment = re.sub('^([=]+)([^=]+)[=]*\s*$', replace_section_name, comment)
-    comment = re.sub('(?<!`)\[\[(.+?)\]\]', replace_crossref, comment)
+    comment = section_matcher.sub(replace_section_name, comment)
+    comment = crossref_matcher.sub(replace_crossref, comment)
 
     return comment
 
+
+class CrossrefIndex(object):
+
+    """
+    An index of the files being documented and of the anchors each of their
+    pages declares, built in a single pass over the sources before any of them
+    is rendered. Cross-references are resolved against it in constant time,
+    and it keeps the references made by each file so that broken ones can be
+    reported. Re-`add()` a file when it changes to keep the index up to date.
+
+    Files can be referred to by their path, as given, or by their name alone.
+    If pages hold at most `page_size` sections, links to an anchor point to
+    the page it is on. `remove()` a file when it goes away.
+    """
+
+    def __init__(self, preserve_paths=True, outdir=None, page_size=None):
+        if not outdir:
+            raise TypeError("Missing the required 'outdir' keyword argument.")
+        self.preserve_paths = preserve_paths
+        self.outdir = outdir
+        self.page_size = page_size
+        self.hrefs = {}
+        self.anchors = {}
+        self.references = {}
+        self._names = {}
+
+    def add(self, source, code, language=None):
+        """Index, or re-index, `source` given its contents."""
+        language = get_language(source, code, language=language)
+        self.add_sections(source, parse_iter(code.split("\n"), language))
+
+    def add_sections(self, source, sections):
+        """Index, or re-index, `source` given its parsed sections."""
+        # Every anchor, with the number of the section it is in.
+        anchors = {}
+        references = []
+        for i, section in enumerate(sections):
+            anchors["section-{}".format(i)] = i
+            declaration = section_matcher.match(section["docs_text"])
+            if declaration:
+                anchors.setdefault(sanitize_section_name(declaration.group(2)), i)
+            references.extend(crossref_matcher.findall(section["docs_text"]))
+
+        self.hrefs[source] = path.basename(destination(
+            source, preserve_paths=self.preserve_paths, outdir=self.outdir))
+        self.anchors[source] = anchors
+        self.references[source] = references
+        self._names[path.normpath(source)] = source
+        self._names.setdefault(path.basename(source), source)
+
+    def remove(self, source):
+        for table in (self.hrefs, self.anchors, self.references):
+            table.pop(source, None)
+        for name, indexed in list(self._names.items()):
+            if indexed == source:
+                del self._names[name]
+        # Another file with the same name may be referred to by it now.
+        for indexed in sorted(self.hrefs):
+            self._names.setdefault(path.basename(indexed), indexed)
+
+    def lookup(self, name):
+        """The indexed source that `name` refers to, or `None`."""
+        return self._names.get(name) or self._names.get(path.normpath(name))
+
+    def href(self, name, anchor=None):
+        """
+        The link to the page for the file `name`, or to the page holding
+        `anchor` if the file is paginated, or `None` if the file is unknown.
+        """
+        source = self.lookup(name)
+        if source is None:
+            return None
+        section = self.anchors[source].get(anchor)
+        if self.page_size and section is not None:
+            return page_destination(self.hrefs[source], section // self.page_size)
+        return self.hrefs[source]
+
+    def links(self, source):
+        """
+        List the `[reference, href]` of every cross-reference that `source`
+        makes, as they resolve now. Its page has to be rendered again whenever
+        these change, even if the source itself did not: for example, when an
+        anchor it links to moves to another page of a paginated file.
+        """
+        links = []
+        for reference in self.references.get(source, []):
+            name, _, anchor = reference.partition("#")
+            links.append([reference, self.href(name, anchor or None)])
+        return links
+
+    def broken_links(self):
+        """
+        List the `(source, reference)` of every cross-reference to a file or an
+        anchor which is not in the index.
+        """
+        broken = []
+        for source in sorted(self.references):
+            for reference in self.references[source]:
+                name, _, anchor = reference.partition("#")
+                target = self.lookup(name)
+                if target is None or anchor and anchor not in self.anchors[target]:
+                    broken.append((source, reference))
+        return broken
+
+
+def build_index(sources, preserve_paths=True, outdir=None, language=None,
+                encoding="utf8", page_size=None):
+    """Build the `CrossrefIndex` for a whole set of sources."""
+
+    index = CrossrefIndex(preserve_paths=preserve_paths, outdir=outdir,
+                          page_size=page_size)
+    for source in sources:
+        with open(source, "rb") as f:
+            if path.getsize(source) <= STREAM_THRESHOLD:
+                index.add(source, f.read().decode(encoding), language=language)
+                continue
+            # Sources too big to hold in memory are parsed as they are read.
+            from pycco.stream import read_lines
+            sample = f.read(STREAM_CHUNK_SIZE).decode(encoding, "ignore")
+            source_language = get_language(source, sample, language=language)
+            f.seek(0)
+            index.add_sections(source, parse_iter(
+                read_lines(f, encoding), source_language,
+                max_size=STREAM_SECTION_SIZE))
+    return index
+
 # === Highlighting the source code ===
 
 # The start of each Pygments highlight block.
@@ -245,7 +528,7 @@ highlight_start = "<div class=\"highlight\"><pre>"
 highlight_end = "</pre></div>"
 
 
-def highlight(sections, language, **kwargs):
+def highlight(sections, language, cache_dir=None, granular=False, **kwargs):
     """
     Highlights a single chunk of code using the **Pygments** module, and runs
     the text of its corresponding comment through **Markdown**.
@@ -253,26 +536,130 @@ def highlight(sections, language, **kwargs):
     We process the entire file in a single call to Pygments by inserting little
     marker comments between each section and then splitting the result string
     wherever our markers occur.
+
+    If a `cache_dir` is given, the split fragments are kept there, keyed by the
+    code, the lexer and the Pygments version, and Pygments is skipped entirely
+    whenever the same code has been highlighted before.
+
+    In `granular` mode, only the sections which changed since the file was last
+    highlighted in this process go through Pygments (see
+    `highlight_changed_sections()`).
+    """
+    from pycco.compat import pycco_zip_longest
+
+    with trace.span("highlight"):
+        fragments = None
+        if granular:
+            fragments = highlight_changed_sections(sections, language)
+
+        if fragments is None:
+            code = language["divider_text"].join(section["code_text"].rstrip()
+                                                 for section in sections)
+            if cache_dir:
+                cache = DiskCache(cache_dir)
+                key = highlight_key(language["name"], code)
+                fragments = cache.get(key)
+            if not cache_dir or fragments is None:
+                fragments = highlight_code(code, language)
+                if cache_dir:
+                    cache.put(key, fragments)
+            if granular:
+                remember_sections(sections, language, fragments)
+
+    zipped = pycco_zip_longest(fragments, sections, range(len(sections)), fillvalue="")
+
+    with trace.span("markdown"):
+        return [highlight_section(*z, **kwargs) for z in zipped]
+
+
+def highlight_code(code, language):
     """
-    from compat import pycco_zip_longest
-    output = pygments.highlight(
-        language["divider_text"].join(section["code_text"].rstrip()
-                                      for section in sections),
-        language["lexer"],
-        formatters.get_formatter_by_name("html"))
+    Run code joined with the language's dividers through Pygments, and split
+    the highlighted result back up into one fragment per section.
+    """
+    import pygments
+    from pygments import formatters
 
+    output = pygments.highlight(code, get_lexer(language),
+                                formatters.get_formatter_by_name("html"))
     output = output.replace(highlight_start, "").replace(highlight_end, "")
-    fragments = re.split(language["divider_html"], output)
-    zipped = pycco_zip_longest(fragments, sections, xrange(len(sections)), fillvalue="")
+    return re.split(language["divider_html"], output)
+
+
+# === Section-granular highlighting ===
+
+# When a file is edited in `--watch` mode, usually only one or two of its
+# sections change. The fragment for each section's code is kept in this cache,
+# keyed by the language and the code, so that the next time round only the
+# sections that changed need to be highlighted.
+#
+# A cached fragment is only valid if the lexer is back in its initial state at
+# both ends of the section. Our dividers are only highlighted as comments when
+# it is, so a fragment is only cached once the dividers on both sides of its
+# section came out as comments. Pygments also treats the very start and end of
+# its input specially, so the first and last sections of a file are not cached
+# but highlighted again every time.
+SECTION_CACHE_SIZE = 16384
+section_cache = LRUCache(SECTION_CACHE_SIZE)
+
+
+def highlight_changed_sections(sections, language):
+    """
+    Get the fragments for `sections`, highlighting only those missing from
+    `section_cache` along with the first and last sections. Returns `None` if
+    none of the sections were cached, or if a changed section leaves the lexer
+    in a different state at its end, which could change the highlighting of
+    the sections after it; the whole file has to be highlighted then.
+    """
+
+    codes = [section["code_text"].rstrip() for section in sections]
+    if len(codes) < 3:
+        return None
+
+    fragments = [section_cache.get((language["name"], code)) for code in codes[1:-1]]
+    fragments = [None] + fragments + [None]
+    missing = [i for i, fragment in enumerate(fragments) if fragment is None]
+    if len(missing) == len(codes):
+        return None
 
-    return [highlight_section(*z, **kwargs) for z in zipped]
+    # Every changed section is followed by a divider, at the very least the one
+    # before the last section, so each of them is checked to end with the lexer
+    # back in its initial state.
+    highlighted = highlight_code(
+        language["divider_text"].join(codes[i] for i in missing), language)
+    if len(highlighted) != len(missing):
+        return None
 
+    for i, fragment in zip(missing, highlighted):
+        fragments[i] = fragment
+        if 0 < i < len(codes) - 1:
+            section_cache.put((language["name"], codes[i]), fragment)
 
-def highlight_section(fragment, section, i, preserve_paths=True, outdir=None):
+    return fragments
+
+
+def remember_sections(sections, language, fragments):
+    """
+    Cache the fragments of a whole highlighted file, as long as every divider
+    in it was recognised.
+    """
+    if len(fragments) == len(sections):
+        for section, fragment in zip(sections[1:-1], fragments[1:-1]):
+            section_cache.put((language["name"], section["code_text"].rstrip()),
+                              fragment)
+
+
+def highlight_section(fragment, section, i, preserve_paths=True, outdir=None,
+                      index=None):
+    """
+    Render a section, given the fragment of Pygments' output for its code,
+    returning a new `Section` with the rendered fields filled in. The section
+    itself, which may also be given as a dictionary, is left alone.
+    """
     if not outdir:
         raise TypeError("Missing the required 'outdir' keyword argument.")
 
-    highlighted = {}
+    highlighted = Section(section["docs_text"], section["code_text"])
     highlighted["code_html"] = "".join([highlight_start,
                                         fragment,
                                         highlight_end])
@@ -285,49 +672,130 @@ def highlight_section(fragment, section, i, preserve_paths=True, outdir=None):
 
     highlighted["docs_html"] = markdown(preprocess(docs_text,
                                                    preserve_paths=preserve_paths,
-                                                   outdir=outdir))
+                                                   outdir=outdir,
+                                                   index=index))
     highlighted["num"] = i
     return highlighted
 
+# === Rendering the comments ===
+
+# Identical comments, such as license headers and boilerplate docstrings, turn
+# up in file after file, so rendered comments are kept in a cache. Its key is
+# the comment after `preprocess()`, which already has the cross-references
+# resolved for the current settings. Check `markdown_cache.info()` to see how
+# well a size is working out for a long `--watch` session.
+MARKDOWN_CACHE_SIZE = 1024
+markdown_cache = LRUCache(MARKDOWN_CACHE_SIZE)
+
+# A single Markdown converter, reset between uses, saves rebuilding the
+# extension pipeline for every section.
+_markdown = None
+
+
+def markdown(text):
+    """
+    Render a preprocessed comment with **Markdown**.
+    """
+
+    global _markdown
+    html = markdown_cache.get(text)
+    if html is None:
+        if _markdown is None:
+            import markdown as markdown_module
+            _markdown = markdown_module.Markdown()
+        html = _markdown.reset().convert(text)
+        markdown_cache.put(text, html)
+    return html
+
 # === HTML Code generation ===
 
 # Create the template that we will use to generate the Pycco HTML page.
 HTML_RESOURCES = pycco_resources.html
 
+# Templates are parsed the first time a page is rendered with them, and the
+# parse trees and renderer are kept for the rest of the run.
+_templates = {}
+
+# The name of the stylesheet, worked out by `stylesheet_name()`.
+_stylesheet_name = None
 
-def generate_html(source, sections, preserve_paths=True, outdir=None):
+# The stylesheet is also written under its plain name, for anything that still
+# links to that, such as pages of older versions or hand-written ones.
+STYLESHEET_NAME = "pycco.css"
+
+# Matches the names `stylesheet_name()` gives, so that the stylesheets of
+# other versions can be removed.
+stylesheet_matcher = re.compile(r"^pycco\.[0-9a-f]{12}\.css$")
+
+
+def get_template(template=HTML_RESOURCES):
+    """
+    Get the `(renderer, parsed template)` pair used to render every page, or
+    every page made from `template`.
+    """
+
+    if template not in _templates:
+        import pystache
+        renderer = _templates[None] = _templates.get(None) or pystache.Renderer()
+        _templates[template] = (renderer, pystache.parse(template))
+    return _templates[template]
+
+
+def stylesheet_name():
+    """
+    The name of the stylesheet in the output directory, which includes a hash
+    of its contents. Pages can then tell browsers to cache it forever, since a
+    different stylesheet always gets a different name.
+    """
+
+    global _stylesheet_name
+    if _stylesheet_name is None:
+        digest = hashlib.sha1(pycco_resources.css.encode("utf-8")).hexdigest()
+        _stylesheet_name = "pycco.{}.css".format(digest[:12])
+    return _stylesheet_name
+
+
+def write_stylesheet(outdir):
+    """Write the stylesheet into `outdir`, under both of its names."""
+    css = pycco_resources.css.encode("utf-8")
+    write_file(path.join(outdir, stylesheet_name()), css)
+    write_file(path.join(outdir, STYLESHEET_NAME), css)
+
+
+def generate_html(source, sections, preserve_paths=True, outdir=None,
+                  pages=None):
     """
     Once all of the code is finished highlighting, we can generate the HTML file
     and write out the documentation. Pass the completed sections into the
-    template found in `resources/pycco.html`.
+    template found in `resources/pycco.html`. One page of a paginated file
+    also gets links to all of its `pages` (see `pycco.paging`).
 
-    Pystache will attempt to recursively render context variables, so we must
-    replace any occurences of `{{`, which is valid in some languages, with a
-    "unique enough" identifier before rendering, and then post-process the
-    rendered template and change the identifier back to `{{`.
+    Pystache inserts the values of triple mustaches verbatim without rendering
+    them again, so code containing `{{` needs no special treatment.
     """
 
     if not outdir:
         raise TypeError("Missing the required 'outdir' keyword argument")
     title = path.basename(source)
     dest = destination(source, preserve_paths=preserve_paths, outdir=outdir)
-    csspath = path.relpath(path.join(outdir, "pycco.css"), path.split(dest)[0])
+    csspath = path.relpath(path.join(outdir, stylesheet_name()),
+                           path.split(dest)[0])
 
-    for sect in sections:
-        sect["code_html"] = re.sub(r"\{\{", r"__DOUBLE_OPEN_STACHE__", sect["code_html"])
-
-    rendered = pystache.render(
-        HTML_RESOURCES,
+    renderer, template = get_template()
+    rendered = renderer.render(
+        template,
         {
             "title": title,
             "stylesheet": csspath,
             "sections": sections,
+            "pages?": bool(pages),
+            "pages": pages or [],
             "source": source,
             "path": path,
             "destination": destination
         })
 
-    return re.sub(r"__DOUBLE_OPEN_STACHE__", "{{", rendered).encode("utf-8")
+    return rendered.encode("utf-8")
 
 
 # A list of the languages that Pycco supports, mapping the file extension to
@@ -382,36 +850,43 @@ for ext, l in languages.items():
     # on this to recover the original sections.
     l["divider_html"] = re.compile(r'\n*<span class="c[1]?">' + l["symbol"] + 'DIVIDER</span>\n*')
 
-    # Get the Pygments Lexer for this language.
-    l["lexer"] = lexers.get_lexer_by_name(l["name"])
+# Look up languages by name, for `--force-language`.
+languages_by_name = dict((l["name"], l) for l in languages.values())
+
+
+def get_lexer(language):
+    """
+    Get the Pygments lexer for a language. Lexers are only built the first time
+    a language is actually highlighted, and are then kept on the language.
+    """
+
+    if "lexer" not in language:
+        from pygments import lexers
+        language["lexer"] = lexers.get_lexer_by_name(language["name"])
+    return language["lexer"]
 
 
 def get_language(source, code, language=None):
-    """Get the current language we're documenting, based on the extension."""
+    """
+    Get the current language we're documenting, based on the extension. Other
+    sources are recognised by `pycco.detect`, from their shebang line, a
+    modeline or their name, or by looking at their first few lines.
+    """
 
     if language is not None:
-        for l in languages.values():
-            if l["name"] == language:
-                return l
-        else:
-            raise ValueError("Unknown forced language: " + language)
+        if language in languages_by_name:
+            return languages_by_name[language]
+        raise ValueError("Unknown forced language: " + language)
 
     m = re.match(r'.*(\..+)', os.path.basename(source)) if source else None
     if m and m.group(1) in languages:
         return languages[m.group(1)]
-    else:
-        try:
-            lang = lexers.guess_lexer(code).name.lower()
-            for l in languages.values():
-                if l["name"] == lang:
-                    return l
-            else:
-                raise ValueError()
-        except ValueError:
-            # If pygments can't find any lexers, it will raise its own
-            # subclass of ValueError. We will catch it and raise ours
-            # for consistency.
-            raise ValueError("Can't figure out the language!")
+
+    from pycco import detect
+    detected = detect.detect_language(source, code)
+    if detected is None:
+        raise ValueError("Can't figure out the language!")
+    return detected
 
 
 def destination(filepath, preserve_paths=True, outdir=None):
@@ -438,6 +913,16 @@ def destination(filepath, preserve_paths=True, outdir=None):
     return dest
 
 
+def page_destination(dest, page):
+    """
+    The path of page `page`, counting from zero, of a paginated file whose
+    first page is `dest`: `example.html`, `example.page-2.html` and so on.
+    """
+    if not page:
+        return dest
+    return u"{}.page-{}.html".format(re.sub(r"\.html$", "", dest), page + 1)
+
+
 def remove_control_chars(s):
     # Sanitization regexp copied from
     # http://stackoverflow.com/questions/92438/stripping-non-printable-characters-from-a-string-in-python
@@ -458,8 +943,440 @@ def ensure_directory(directory):
     return directory
 
 
-def process(sources, preserve_paths=True, outdir=None, language=None, encoding="utf8"):
-    """For each source file passed as argument, generate the documentation."""
+# === Pipelined I/O ===
+
+# How many files may be waiting to be read, or to be written, by the background
+# threads of `process_iter()` at any time.
+IO_QUEUE_DEPTH = 8
+
+# Sources bigger than `STREAM_THRESHOLD` bytes, such as generated code, are
+# documented by `pycco.stream`, which reads, highlights and writes them
+# `STREAM_CHUNK_SIZE` characters at a time so that memory use stays the same
+# however big they get. Their code is also cut into sections of at most about
+# `STREAM_SECTION_SIZE` characters, since a long stretch without comments would
+# otherwise make up a single section as big as the source.
+STREAM_THRESHOLD = 32 * 1024 * 1024
+STREAM_CHUNK_SIZE = 256 * 1024
+STREAM_SECTION_SIZE = 256 * 1024
+
+
+def write_file(filename, data):
+    """
+    Write the bytes `data` to `filename`, creating its directory if needed. The
+    file is written under a temporary name and renamed into place, so nobody
+    ever sees half a page. If the file already holds exactly `data` it is left
+    alone, keeping its modification time, and `False` is returned.
+    """
+    try:
+        if path.getsize(filename) == len(data):
+            with open(filename, "rb") as f:
+                if f.read() == data:
+                    return False
+    except (IOError, OSError):
+        pass
+
+    directory = path.dirname(filename)
+    if directory and not path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            pass
+
+    temp = "{}.{}.{}.tmp".format(filename, os.getpid(),
+                                 threading.current_thread().ident)
+    try:
+        with open(temp, "wb") as f:
+            f.write(data)
+        pycco_replace(temp, filename)
+    except BaseException:
+        try:
+            os.remove(temp)
+        except OSError:
+            pass
+        raise
+    return True
+
+
+class Writer(object):
+
+    """
+    Writes files with `write_file()` on a background thread, in the order they
+    were queued, so that the next page can be rendered while the last one is
+    written. At most `depth` files wait to be written; `write()` blocks while
+    the queue is full. The first error is kept in `error`, and nothing more is
+    written after it.
+    """
+
+    def __init__(self, depth=IO_QUEUE_DEPTH):
+        self.error = None
+        self.queued = 0
+        self.finished = 0
+        self._queue = pycco_queue.Queue(depth)
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def write(self, filename, data, source=None):
+        self.queued += 1
+        self._queue.put((filename, data, source))
+
+    def close(self):
+        """Wait for every queued file to be written, raising the first error."""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            filename, data, source = item
+            try:
+                if self.error is None:
+                    with trace.span("write", source):
+                        write_file(filename, data)
+            except Exception as e:
+                self.error = e
+            self.finished += 1
+
+
+def read_ahead(sources, depth=IO_QUEUE_DEPTH):
+    """
+    Yield `(source, contents, error)` for each of `sources`, read on a
+    background thread up to `depth` files ahead. If a source could not be read,
+    or `sources` itself failed, the exception is handed back as its `error`.
+    Sources bigger than `STREAM_THRESHOLD` are not read, and have no
+    `contents`, so that they can be streamed.
+    """
+
+    results = pycco_queue.Queue(depth)
+    stop = threading.Event()
+    done = object()
+
+    def reader():
+        try:
+            for source in sources:
+                if stop.is_set():
+                    break
+                try:
+                    if path.getsize(source) > STREAM_THRESHOLD:
+                        item = (source, None, None)
+                    else:
+                        with trace.span("read", source):
+                            with open(source, "rb") as f:
+                                item = (source, f.read(), None)
+                except (IOError, OSError) as e:
+                    item = (source, None, e)
+                results.put(item)
+        except Exception as e:
+            results.put((None, None, e))
+        results.put(done)
+
+    thread = threading.Thread(target=reader)
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            item = results.get()
+            if item is done:
+                break
+            yield item
+    finally:
+        # Let the reader run to the end of its current file, and wait for it.
+        stop.set()
+        while thread.is_alive():
+            try:
+                results.get(timeout=0.1)
+            except pycco_queue.Empty:
+                pass
+        thread.join()
+
+
+# === Incremental builds ===
+
+# Every output directory carries a manifest describing the inputs each page
+# was built from, so that unchanged sources can be skipped on the next run.
+MANIFEST_NAME = ".pycco-manifest.json"
+
+
+def build_versions():
+    """
+    The versions of everything besides the source itself that can change the
+    rendered output. A manifest written under different versions is thrown away.
+    """
+    import markdown
+    from pycco import __version__
+
+    resources = (pycco_resources.html + pycco_resources.css).encode("utf-8")
+    return {
+        "pycco": __version__,
+        "pygments": pygments_version(),
+        "markdown": getattr(markdown, "__version__",
+                            getattr(markdown, "version", None)),
+        "resources": hashlib.sha1(resources).hexdigest(),
+    }
+
+
+def load_manifest(outdir):
+    """
+    Read the manifest for `outdir`, returning a mapping of source paths to their
+    recorded fingerprints. A missing, corrupt or outdated manifest is empty.
+    """
+    try:
+        with open(path.join(outdir, MANIFEST_NAME), "rb") as f:
+            manifest = json.loads(f.read().decode("utf-8"))
+    except (IOError, OSError, ValueError):
+        return {}
+
+    if not isinstance(manifest, dict) or manifest.get("versions") != build_versions():
+        return {}
+    return manifest.get("files", {})
+
+
+def save_manifest(outdir, files):
+    """
+    Write the manifest for `outdir`. The file is replaced atomically so that an
+    interrupted build never leaves a half-written manifest behind.
+    """
+    manifest = {"versions": build_versions(), "files": files}
+    write_file(path.join(outdir, MANIFEST_NAME),
+               json.dumps(manifest, indent=1, sort_keys=True).encode("utf-8"))
+
+
+def fingerprint(source, preserve_paths=True, outdir=None, language=None,
+                encoding="utf8", contents=None, page_size=None, index=None):
+    """
+    Describe everything about a single source that its rendered page depends
+    on: the hash of its contents, the options it is rendered with, the
+    stylesheet it links to and, given the project's `CrossrefIndex`, where
+    its cross-references lead. The source is read unless its `contents` are
+    given.
+    """
+    digest = hashlib.sha1()
+    if contents is None:
+        with open(source, "rb") as f:
+            for chunk in iter(lambda: f.read(STREAM_CHUNK_SIZE), b""):
+                digest.update(chunk)
+    else:
+        digest.update(contents)
+    return {
+        "sha1": digest.hexdigest(),
+        "language": language,
+        "preserve_paths": bool(preserve_paths),
+        "encoding": encoding,
+        "destination": destination(source, preserve_paths=preserve_paths,
+                                   outdir=outdir),
+        "page_size": page_size,
+        "stylesheet": stylesheet_name(),
+        "links": index.links(source) if index is not None else None,
+    }
+
+
+# === Project index ===
+
+# Besides a page per source, every output directory gets an `index.html` listing
+# the documented files by directory, and a prebuilt search index. Projects with
+# more than `INDEX_PAGE_SIZE` files get an index page per directory instead,
+# linked from the main one. If a source of the project is itself documented as
+# `index.html`, the main index page is called `pycco-index.html` instead.
+SEARCH_INDEX_NAME = "search-index.json"
+INDEX_PAGE_SIZE = 500
+
+# Matches a Markdown heading written `# Like this`, and the line of `=` or `-`
+# underlining a heading written on the line above it.
+atx_heading_matcher = re.compile(r'^(#{1,6})[ \t]*(.+?)[ \t]*#*[ \t]*$')
+setext_underline_matcher = re.compile(r'^(=+|-+)[ \t]*$')
+
+# Pygments marks up the names of functions and classes where they are defined.
+identifier_matcher = re.compile(r'<span class="n[fc]">([^<]+)</span>')
+
+
+def section_headings(docs_text):
+    """
+    List the `[text, anchor]` of each heading in the comment of a section. Only
+    the `=== declared ===` sections have an anchor; other Markdown headings
+    have `None`.
+    """
+
+    declaration = section_matcher.match(docs_text)
+    if declaration:
+        name = declaration.group(2)
+        return [[name.strip(), sanitize_section_name(name)]]
+
+    headings = []
+    lines = docs_text.split("\n")
+    for i, line in enumerate(lines):
+        # Indented lines are code blocks.
+        if line.startswith(("    ", "\t")):
+            continue
+        atx = atx_heading_matcher.match(line)
+        if atx:
+            text = atx.group(2)
+        elif line.strip() and (i == 0 or not lines[i - 1].strip()) \
+                and i + 1 < len(lines) \
+                and setext_underline_matcher.match(lines[i + 1]):
+            text = line
+        else:
+            continue
+        headings.append([re.sub(r"[*`]", "", text).strip(), None])
+    return headings
+
+
+def search_entry(source, dest, sections, outdir):
+    """
+    Describe a rendered page for the search index, given its highlighted
+    sections: where it is, its title, the headings in its comments, with their
+    anchors, and the names its code defines.
+    """
+
+    headings = []
+    identifiers = set()
+    for section in sections:
+        headings.extend(section_headings(section["docs_text"]))
+        identifiers.update(identifier_matcher.findall(section["code_html"]))
+
+    return {
+        "source": source,
+        "url": path.relpath(dest, outdir).replace(os.sep, "/"),
+        "title": path.basename(source),
+        "headings": headings,
+        "identifiers": sorted(identifiers),
+    }
+
+
+def load_search_index(outdir):
+    """
+    Read the search index for `outdir`, as a mapping of sources to their
+    entries, leaving out any page which no longer exists.
+    """
+    try:
+        with open(path.join(outdir, SEARCH_INDEX_NAME), "rb") as f:
+            entries = json.loads(f.read().decode("utf-8"))["files"]
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        return {}
+    return dict((entry["source"], entry) for entry in entries
+                if path.exists(path.join(outdir, entry["url"])))
+
+
+def write_project_index(outdir, entries):
+    """
+    Write the search index and the index pages for `outdir`, given the search
+    entries of every page in it. Returns the names of the files written.
+    """
+
+    written = [SEARCH_INDEX_NAME]
+    entries = sorted(entries.values(), key=lambda entry: entry["source"])
+    write_file(path.join(outdir, SEARCH_INDEX_NAME),
+               json.dumps({"files": entries}, sort_keys=True,
+                          separators=(",", ":")).encode("utf-8"))
+
+    packages = collections.OrderedDict()
+    for entry in entries:
+        name = path.dirname(path.normpath(entry["source"])) or "."
+        packages.setdefault(name, []).append(entry)
+
+    def package(name, files, url=None):
+        return {"name": name, "url": url, "count": len(files),
+                "files?": bool(files), "files": files}
+
+    def write_page(filename, title, packages):
+        renderer, template = get_template(pycco_resources.index_html)
+        html = renderer.render(template, {"title": title,
+                                          "stylesheet": stylesheet_name(),
+                                          "packages": packages})
+        write_file(path.join(outdir, filename), html.encode("utf-8"))
+        written.append(filename)
+
+    index_name = "index.html"
+    if any(entry["url"] == index_name for entry in entries):
+        index_name = "pycco-index.html"
+
+    if len(entries) <= INDEX_PAGE_SIZE:
+        write_page(index_name, "Index",
+                   [package(name, files) for name, files in packages.items()])
+        return written
+
+    shards = []
+    for name, files in packages.items():
+        filename = index_page_name(name)
+        write_page(filename, name, [package(name, files)])
+        shard = package(name, [], url=filename)
+        shard["count"] = len(files)
+        shards.append(shard)
+    write_page(index_name, "Index", shards)
+    return written
+
+
+def index_page_name(package):
+    """
+    The name of the index page of the directory `package` in a big project. A
+    hash of the directory keeps `a/b` and `a-b` apart, while the rest of the
+    name says which directory it is.
+    """
+    slug = re.sub(r"[^\w.-]+", "-", package).strip("-.") or "root"
+    digest = hashlib.sha1(package.encode("utf-8")).hexdigest()
+    return "index-{}-{}.html".format(slug, digest[:8])
+
+
+def update_project(outdir, entries, compress=False):
+    """
+    Bring the files describing the whole of `outdir` up to date, given the
+    search entries of every page in it: the project index, and the ETags
+    manifest and compressed copies for static servers (see `pycco.static`).
+    Stylesheets left behind by other versions are removed.
+    """
+    written = write_project_index(outdir, entries)
+
+    from pycco import static
+    for name in os.listdir(outdir):
+        if stylesheet_matcher.match(name) and name != stylesheet_name():
+            for suffix in [""] + sorted(static.SUFFIXES.values()):
+                if path.exists(path.join(outdir, name + suffix)):
+                    os.remove(path.join(outdir, name + suffix))
+
+    static.publish(outdir,
+                   [stylesheet_name(), STYLESHEET_NAME] + written +
+                   [url for entry in entries.values()
+                    for url in entry.get("pages", [entry["url"]])],
+                   compress=compress)
+
+
+def process(sources, preserve_paths=True, outdir=None, language=None,
+            encoding="utf8", jobs=1, force=False, cache_dir=None, index=None,
+            compress=False, page_size=None):
+    """
+    For each source file passed as argument, generate the documentation.
+
+    When `jobs` is greater than one, the files are rendered in a pool of that
+    many worker processes; a `jobs` of `0` uses one worker per CPU. Each worker
+    keeps its own lexers and Markdown state warm across the files it renders,
+    and results are collected in order so the output stays deterministic.
+
+    Sources whose contents and options match the manifest in `outdir`, and
+    whose page still exists, are skipped unless `force` is set. Either way, the
+    entries of other files already in the manifest are kept.
+
+    Highlighted code is cached in `cache_dir`, if one is given, so that it can
+    be reused by later runs and by other builds on the same machine.
+
+    Cross-references are resolved against `index`, a `CrossrefIndex` built by
+    `build_index()` for the whole project. Unless one is given, it is built
+    here from `sources`.
+
+    Files with more than `page_size` sections, if given, are split into pages
+    of that many sections (see `pycco.paging`). The index then also finds the
+    page each anchor is on, so a given index must be built with the same
+    `page_size`.
+
+    Every file is replaced atomically, and only if its contents changed, so
+    pages and the stylesheet that come out the same keep their modification
+    times. The ETags of every file are written to a manifest for static
+    servers, and with `compress` set, compressed copies of them are written
+    as well (see `pycco.static`).
+    """
 
     if not outdir:
         raise TypeError("Missing the required 'outdir' keyword argument.")
@@ -469,37 +1386,355 @@ def process(sources, preserve_paths=True, outdir=None, language=None, encoding="
     sources = sorted(sources)
 
     # Proceed to generating the documentation.
-    if sources:
-        outdir = ensure_directory(outdir)
-        css = open(path.join(outdir, "pycco.css"), "wb")
-        css.write(pycco_resources.css.encode(encoding))
-        css.close()
+    skipped = 0
+    for result in build_iter(sources, preserve_paths=preserve_paths,
+                             outdir=outdir, language=language,
+                             encoding=encoding, jobs=jobs, force=force,
+                             cache_dir=cache_dir, index=index,
+                             compress=compress, page_size=page_size):
+        if result.skipped:
+            skipped += 1
+        else:
+            print("pycco = {} -> {}".format(result.source, result.destination))
+
+    if skipped:
+        print("pycco: skipped {} unchanged file(s)".format(skipped))
+
+
+def build_iter(sources, preserve_paths=True, outdir=None, language=None,
+               encoding="utf8", jobs=1, force=False, cache_dir=None,
+               index=None, granular=False, compress=False, page_size=None):
+    """
+    Document `sources` into `outdir` the way every build does: write the
+    stylesheet, build the `CrossrefIndex` unless one is given, render the
+    sources with `process_iter()`, yielding the `ProcessResult` of each as it
+    is finished, and once they are all done, bring the project index and the
+    files for static servers up to date. The options are those of
+    `process_iter()`, and `sources` are documented in sorted order.
+    """
+
+    if not outdir:
+        raise TypeError("Missing the required 'outdir' keyword argument.")
+
+    sources = sorted(sources)
+    if not sources:
+        return
+
+    outdir = ensure_directory(outdir)
+    write_stylesheet(outdir)
+
+    if not jobs:
+        jobs = multiprocessing.cpu_count()
+
+    if index is None:
+        index = build_index(sources, preserve_paths=preserve_paths,
+                            outdir=outdir, language=language,
+                            encoding=encoding, page_size=page_size)
+
+    entries = load_search_index(outdir)
+    for result in process_iter(sources, preserve_paths=preserve_paths,
+                               outdir=outdir, language=language,
+                               encoding=encoding,
+                               jobs=min(jobs, len(sources)), force=force,
+                               cache_dir=cache_dir, index=index,
+                               granular=granular, page_size=page_size):
+        if not result.skipped:
+            entries[result.source] = result.search
+        yield result
+
+    update_project(outdir, entries, compress=compress)
+
 
-        def next_file():
-            s = sources.pop(0)
-            dest = destination(s, preserve_paths=preserve_paths, outdir=outdir)
+# The outcome of documenting a single source: where its page went, how many
+# bytes were written, how long it took in seconds, whether it was skipped
+# because it had not changed and, if it was rendered, its search entry.
+ProcessResult = collections.namedtuple(
+    "ProcessResult",
+    ["source", "destination", "size", "elapsed", "skipped", "search"])
 
+
+def process_iter(sources, preserve_paths=True, outdir=None, language=None,
+                 encoding="utf8", jobs=1, force=False, cache_dir=None,
+                 index=None, granular=False, page_size=None):
+    """
+    Generate the documentation for each source, yielding a `ProcessResult` as
+    soon as each file is finished. `sources` may be any iterable and is
+    consumed lazily, in order; nothing is sorted and no stylesheet is written,
+    which is left to the caller (see `process()`).
+
+    When rendering in this process, sources are read ahead and pages written
+    behind on background threads. Either way, a result is only yielded once
+    its page is on disk.
+
+    The options are the same as for `process()`, plus `granular`, which only
+    re-highlights the sections of each file that changed since it was last
+    highlighted in this process; it is only worth it with `jobs=1`, as each
+    worker process keeps its own cache. The manifest in `outdir` is
+    updated, and the highlighting cache trimmed, once the iteration finishes or
+    is abandoned.
+    """
+
+    if not outdir:
+        raise TypeError("Missing the required 'outdir' keyword argument.")
+
+    outdir = ensure_directory(outdir)
+    # Forced builds ignore the entries of their sources, but keep those of
+    # every other file.
+    manifest = load_manifest(outdir)
+    previous = (lambda source: None) if force else manifest.get
+    work = functools.partial(_process_one,
+                             preserve_paths=preserve_paths,
+                             outdir=outdir,
+                             language=language,
+                             encoding=encoding,
+                             cache_dir=cache_dir,
+                             granular=granular,
+                             page_size=page_size)
+
+    if not jobs:
+        jobs = multiprocessing.cpu_count()
+
+    # Worker processes hand the spans they record back to be traced here.
+    if jobs > 1 and trace.enabled():
+        work = functools.partial(work, collect_trace=True)
+
+    try:
+        if jobs > 1:
+            # The index is sent to each worker once, rather than with every
+            # file.
+            pool = multiprocessing.Pool(jobs, _init_worker, (index,))
+            tasks = ((s, previous(s), None) for s in sources)
             try:
-                os.makedirs(path.split(dest)[0])
-            except OSError:
-                pass
+                # `imap` hands back results in the order the sources were
+                # submitted, however the workers happen to finish.
+                for result, entry, events in pool.imap(work, tasks):
+                    for event in events:
+                        trace.record(event)
+                    manifest[result.source] = entry
+                    yield result
+                pool.close()
+            except BaseException:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+        else:
+            writer = Writer()
+            work = functools.partial(work, index=index, write=writer.write)
+            # The results waiting for their pages to be written, with the
+            # number of files the writer has to finish before they are.
+            pending = collections.deque()
+
+            def written(wait=False):
+                if wait:
+                    writer.close()
+                while pending and (wait or pending[0][0] <= writer.finished):
+                    if writer.error is not None:
+                        raise writer.error
+                    yield pending.popleft()
+
+            try:
+                for source, contents, error in read_ahead(sources):
+                    if error is None:
+                        result, entry, events = work(
+                            (source, previous(source), contents))
+                        pending.append((writer.queued, result, entry))
+                    # The sources before one that cannot be read are still
+                    # handed back first.
+                    for queued, result, entry in written(wait=error is not None):
+                        manifest[result.source] = entry
+                        yield result
+                    if error is not None:
+                        raise error
+                for queued, result, entry in written(wait=True):
+                    manifest[result.source] = entry
+                    yield result
+            finally:
+                writer.close()
+    finally:
+        # Record whatever was rendered, even if the build was cut short.
+        save_manifest(outdir, manifest)
+        if cache_dir:
+            DiskCache(cache_dir).evict()
+
+
+# The `CrossrefIndex` used by a worker process.
+_worker_index = None
+
+
+def _init_worker(index):
+    global _worker_index
+    _worker_index = index
+
+
+def _process_one(task, preserve_paths=True, outdir=None, language=None,
+                 encoding="utf8", cache_dir=None, collect_trace=False,
+                 index=None, granular=False, write=None, page_size=None):
+    """
+    Document one `(source, manifest entry, contents)` task, skipping the source
+    if it still matches its entry. The source is read unless its `contents`
+    are given, and the page, or each of its pages if `page_size` is given, is
+    written with `write(filename, data, source)` if given, or with
+    `write_file()` straight away. Sources bigger than
+    `STREAM_THRESHOLD` are streamed by `pycco.stream` instead,
+    unless their `contents` were given. Returns the
+    `ProcessResult`, the new entry and, if `collect_trace` is set, the trace
+    events recorded along the way.
+    """
 
-            with open(dest, "wb") as f:
-                f.write(generate_documentation(s, preserve_paths=preserve_paths,
-                                               outdir=outdir,
-                                               language=language,
-                                               encoding=encoding))
+    source, previous, contents = task
+    if index is None:
+        index = _worker_index
+    if collect_trace:
+        trace.start()
 
-            print("pycco = {} -> {}".format(s, dest))
+    try:
+        with trace.span("file", source):
+            start = time.time()
+            stream = contents is None and path.getsize(source) > STREAM_THRESHOLD
+            if contents is None and not stream:
+                with trace.span("read", source):
+                    with open(source, "rb") as f:
+                        contents = f.read()
+            with trace.span("fingerprint", source):
+                entry = fingerprint(source, preserve_paths=preserve_paths,
+                                    outdir=outdir, language=language,
+                                    encoding=encoding, contents=contents,
+                                    page_size=page_size, index=index)
+            dest = entry["destination"]
+
+            if entry == previous and path.exists(dest):
+                result = ProcessResult(source, dest, 0, time.time() - start,
+                                       True, None)
+            elif stream:
+                from pycco import paging
+                from pycco.stream import stream_documentation
+                size, search = stream_documentation(source, outdir=outdir,
+                                                    preserve_paths=preserve_paths,
+                                                    language=language,
+                                                    encoding=encoding,
+                                                    index=index)
+                paging.remove_stale_pages(dest, 1)
+                result = ProcessResult(source, dest, size, time.time() - start,
+                                       False, search)
+            else:
+                from pycco import paging
+                pages = paging.render_pages(source, contents.decode(encoding),
+                                            outdir, preserve_paths, language,
+                                            page_size, cache_dir=cache_dir,
+                                            index=index, granular=granular)
+                for page_dest, html, sections in pages:
+                    if write is not None:
+                        write(page_dest, html, source)
+                    else:
+                        with trace.span("write", source):
+                            write_file(page_dest, html)
+                paging.remove_stale_pages(dest, len(pages))
 
-            if sources:
-                next_file()
-        next_file()
+                result = ProcessResult(source, dest,
+                                       sum(len(html) for _, html, _ in pages),
+                                       time.time() - start, False,
+                                       paging.search_entry(source, pages, outdir))
+    finally:
+        events = trace.stop().events if collect_trace else []
 
-__all__ = ("process", "generate_documentation")
+    return result, entry, events
 
+__all__ = ("process", "process_iter", "generate_documentation", "Section")
 
-def monitor(sources, opts):
+
+class ChangeBatcher(object):
+
+    """
+    Collects the sources touched by file system events and hands them out in
+    batches, once no new event has arrived for `debounce` seconds. An editor
+    saving a file often fires several events in a row; they all end up in the
+    same batch, and each file is listed only once.
+    """
+
+    def __init__(self, debounce=0.2):
+        self.debounce = debounce
+        self._pending = set()
+        self._last_event = 0
+        self._lock = threading.Lock()
+
+    def add(self, source):
+        with self._lock:
+            self._pending.add(source)
+            self._last_event = time.time()
+
+    def pop_batch(self):
+        """
+        Return the sorted sources of the current batch if it has settled, and
+        an empty list otherwise.
+        """
+        with self._lock:
+            if not self._pending \
+               or time.time() - self._last_event < self.debounce:
+                return []
+            batch = sorted(self._pending)
+            self._pending.clear()
+            return batch
+
+
+def regenerate(batch, opts, index=None):
+    """
+    Re-generate the documentation for a batch of changed sources, reporting
+    how long the whole batch took. Sources whose contents did not actually
+    change are skipped, and the shared stylesheet is left alone. The pages of
+    deleted sources, and their compressed copies, are removed, along with
+    their entries in the project index. If a `CrossrefIndex` is given, the
+    changed sources are re-indexed first, and those which were deleted are
+    removed from it. Only the sections which were edited are highlighted
+    again.
+    """
+    from pycco import vcs
+
+    start = time.time()
+    deleted = [source for source in batch if not path.exists(source)]
+    changed = [source for source in batch if source not in deleted]
+    if index is not None:
+        for source in deleted:
+            index.remove(source)
+        for source in changed:
+            with open(source, "rb") as f:
+                index.add(source, f.read().decode("utf8"), language=opts.language)
+        for source, reference in index.broken_links():
+            if source in batch:
+                print("pycco: {}: broken link [[{}]]".format(source, reference),
+                      file=sys.stderr)
+
+    entries = load_search_index(opts.outdir)
+    removed = False
+    for source in deleted:
+        dest = destination(source, preserve_paths=opts.paths,
+                           outdir=opts.outdir)
+        for filename in vcs.outputs(dest):
+            os.remove(filename)
+            removed = True
+        if entries.pop(source, None) is not None:
+            removed = True
+
+    rendered = 0
+    for result in process_iter(changed, outdir=opts.outdir,
+                               preserve_paths=opts.paths,
+                               language=opts.language,
+                               cache_dir=opts.cache_dir,
+                               index=index,
+                               granular=True,
+                               page_size=opts.page_size):
+        if not result.skipped:
+            rendered += 1
+            entries[result.source] = result.search
+            print("pycco = {} -> {}".format(result.source, result.destination))
+    if rendered or removed:
+        update_project(opts.outdir, entries, compress=opts.compress)
+
+    print("pycco: regenerated {} of {} changed file(s) in {:.3f}s".format(
+        rendered, len(batch), time.time() - start))
+
+
+def monitor(sources, opts, debounce=0.2, index=None):
     """Monitor each source file and re-generate documentation on change."""
 
     # The watchdog modules are imported in `main()` but we need to re-import
@@ -511,34 +1746,50 @@ def monitor(sources, opts):
     # as specified on the command line.
     absolute_sources = dict((os.path.abspath(source), source)
                             for source in sources)
+    batcher = ChangeBatcher(debounce)
 
     class RegenerateHandler(watchdog.events.FileSystemEventHandler):
 
-        """A handler for recompiling files which triggered watchdog events"""
+        """A handler for queueing files which triggered watchdog events"""
+
+        def queue(self, filename):
+            # Only queue a source file if it was listed on the command line.
+            # Watchdog monitors whole directories, so other files may cause
+            # notifications as well.
+            if filename in absolute_sources:
+                batcher.add(absolute_sources[filename])
 
         def on_modified(self, event):
-            """Regenerate documentation for a file which triggered an event"""
-            # Re-generate documentation from a source file if it was listed on
-            # the command line. Watchdog monitors whole directories, so other
-            # files may cause notifications as well.
-            if event.src_path in absolute_sources:
-                process([absolute_sources[event.src_path]],
-                        outdir=opts.outdir,
-                        preserve_paths=opts.paths)
+            self.queue(event.src_path)
+
+        def on_created(self, event):
+            self.queue(event.src_path)
+
+        def on_deleted(self, event):
+            self.queue(event.src_path)
+
+        def on_moved(self, event):
+            # Editors which save through a temporary file finish by moving it
+            # over the original.
+            self.queue(event.dest_path)
 
     # Set up an observer which monitors all directories for files given on
     # the command line and notifies the handler defined above.
     event_handler = RegenerateHandler()
     observer = watchdog.observers.Observer()
-    directories = set(os.path.split(source)[0] for source in sources)
+    directories = set(os.path.dirname(source) for source in absolute_sources)
     for directory in directories:
         observer.schedule(event_handler, path=directory)
 
-    # Run the file change monitoring loop until the user hits Ctrl-C.
+    # Run the file change monitoring loop until the user hits Ctrl-C,
+    # re-generating each batch of changes as soon as it settles.
     observer.start()
     try:
         while True:
-            time.sleep(1)
+            time.sleep(debounce / 4)
+            batch = batcher.pop_batch()
+            if batch:
+                regenerate(batch, opts, index=index)
     except KeyboardInterrupt:
         observer.stop()
         observer.join()
@@ -561,10 +1812,133 @@ def main():
     parser.add_option('-l', '--force-language', action='store', type='string',
                       dest='language', default=None,
                       help='Force the language for the given files')
+
+    parser.add_option('-j', '--jobs', action='store', type='int',
+                      dest='jobs', default=1,
+                      help='Render files in this many parallel processes (0 uses every CPU)')
+
+    parser.add_option('-f', '--force', action='store_true',
+                      help='Regenerate every file, even if it has not changed since the last run')
+
+    parser.add_option('--cache-dir', action='store', type='string',
+                      dest='cache_dir', default=None,
+                      help='Keep highlighted code in this directory for reuse by later runs')
+
+    parser.add_option('--exclude', action='append', dest='exclude', default=[],
+                      help='Skip files and directories matching this gitignore-style pattern '
+                           'when searching directories and patterns (may be repeated)')
+
+    parser.add_option('--exclude-from', action='append', dest='exclude_from', default=[],
+                      help='Read exclude patterns from this gitignore-style file (may be repeated)')
+
+    parser.add_option('--compress', action='store_true',
+                      help='Also write gzip (and, with the brotli module, Brotli) '
+                           'copies of every file for static servers')
+
+    parser.add_option('--page-size', action='store', type='int',
+                      dest='page_size', default=None,
+                      help='Split files with more sections than this into pages '
+                           'of this many sections')
+
+    parser.add_option('--since', action='store', type='string',
+                      dest='since', default=None,
+                      help='Only document the sources git reports as changed since this '
+                           'revision, and drop or move the pages of deleted and renamed ones')
+
+    parser.add_option('--serve', action='store_true',
+                      help='Run a resident daemon which renders files for --client requests')
+
+    parser.add_option('--client', action='store_true',
+                      help='Have a running daemon render the files, if there is one')
+
+    parser.add_option('--socket', action='store', type='string',
+                      dest='socket', default=None,
+                      help='The Unix socket used by --serve and --client')
+
+    parser.add_option('--idle-timeout', action='store', type='float',
+                      dest='idle_timeout', default=600,
+                      help='Seconds of inactivity after which --serve shuts down')
+
+    parser.add_option('--strict-links', action='store_true', dest='strict_links',
+                      help='Fail if any [[cross-reference]] points to a missing file or section')
+
+    parser.add_option('--trace', action='store', type='string',
+                      dest='trace', default=None,
+                      help='Write a Chrome trace of every stage of the build to this file')
+
+    parser.add_option('--profile', action='store_true',
+                      help='Print the slowest files and stages at the end of the run')
     opts, sources = parser.parse_args()
 
-    process(sources, outdir=opts.outdir, preserve_paths=opts.paths,
-            language=opts.language)
+    # Directories and patterns are searched for every file Pycco can document,
+    # or for every file at all if the language is forced.
+    from pycco.discovery import find_sources
+    sources = find_sources(sources, exclude=opts.exclude,
+                           exclude_from=opts.exclude_from,
+                           extensions=None if opts.language else languages)
+
+    if opts.serve:
+        from pycco import daemon
+        daemon.serve(opts.socket, idle_timeout=opts.idle_timeout)
+        return
+
+    if opts.trace or opts.profile:
+        trace.start()
+
+    # Index the whole project up front, so that every link is looked up in
+    # it, and report every broken link at once. Paginated builds also need the
+    # index to find the page of each anchor. A client leaves that to the
+    # daemon, unless it needs the index itself.
+    index = None
+    if not opts.client or opts.strict_links or opts.since:
+        index = build_index(sorted(sources), outdir=opts.outdir,
+                            preserve_paths=opts.paths, language=opts.language,
+                            page_size=opts.page_size)
+    if opts.strict_links:
+        broken = index.broken_links()
+        for source, reference in broken:
+            print("pycco: {}: broken link [[{}]]".format(source, reference),
+                  file=sys.stderr)
+        if broken:
+            sys.exit(1)
+
+    # Only the sources git reports as changed are documented again, but the
+    # index above still covers the whole project.
+    changed = sources
+    if opts.since:
+        from pycco import vcs
+        try:
+            changes = vcs.changes_since(opts.since)
+        except ValueError as e:
+            sys.exit("pycco: {}".format(e))
+        changed = vcs.prepare_build(
+            changes, sources, opts.outdir, preserve_paths=opts.paths,
+            compress=opts.compress, index=index)
+
+    # Fall back to doing the work here for the sources a daemon did not
+    # document, or for all of them if no daemon is running.
+    if opts.client:
+        from pycco import daemon
+        changed = daemon.client(changed, opts, project=sources)
+        if not changed and not (opts.trace or opts.profile or opts.watch):
+            return
+        if index is None and (changed or opts.watch):
+            index = build_index(sorted(sources), outdir=opts.outdir,
+                                preserve_paths=opts.paths,
+                                language=opts.language,
+                                page_size=opts.page_size)
+
+    process(changed, outdir=opts.outdir, preserve_paths=opts.paths,
+            language=opts.language, jobs=opts.jobs, force=opts.force,
+            cache_dir=opts.cache_dir, index=index, compress=opts.compress,
+            page_size=opts.page_size)
+
+    if opts.trace or opts.profile:
+        tracer = trace.stop()
+        if opts.trace:
+            tracer.write(opts.trace)
+        if opts.profile:
+            print("\n".join(tracer.summary()))
 
     # If the -w / --watch option was present, monitor the source directories
     # for changes and re-generate documentation for source files whenever they
@@ -576,7 +1950,7 @@ def main():
         except ImportError:
             sys.exit('The -w/--watch option requires the watchdog package.')
 
-        monitor(sources, opts)
+        monitor(sources, opts, index=index)
 
 # Run the script.
 if __name__ == "__main__":
@@ -0,0 +1,127 @@
+"""
+Splitting huge files over several pages.
+
+Browsers struggle with a page holding every section of a generated module tens
+of thousands of lines long. With a `page_size`, `process()` splits files with
+more sections than that into pages of `page_size` sections each: the first
+page keeps the usual name, like `example.html`, and the others are called
+`example.page-2.html`, `example.page-3.html` and so on. Every page links to
+all the others.
+
+Sections keep their numbers across pages, so `#section-N` anchors stay the
+same, and the `CrossrefIndex` used while rendering knows which page each
+anchor is on, so `[[example.py#section]]` links to the right page. Where the
+links of a file lead is part of its manifest fingerprint, so it is rendered
+again when an anchor it links to moves to another page. Pages left over from
+an earlier, longer version of a file are removed, along with their
+compressed copies.
+
+Sources big enough to be streamed (see `pycco.stream`) still come out as a
+single page.
+"""
+
+import os
+from os import path
+
+from pycco import main as pycco
+from pycco import trace
+
+
+def page_links(dest, count, current):
+    """The links to each of the `count` pages of `dest`, from page `current`."""
+    return [{"number": page + 1,
+             "url": path.basename(pycco.page_destination(dest, page)),
+             "current": page == current}
+            for page in range(count)]
+
+
+def generate_pages(source, sections, page_size, preserve_paths=True,
+                   outdir=None):
+    """
+    Render highlighted sections as pages of at most `page_size` sections,
+    returning the `(destination, html, sections)` of each. A file with no more
+    sections than that, or any file if `page_size` is `None`, comes out as a
+    single page, just as `generate_html()` renders it.
+    """
+
+    dest = pycco.destination(source, preserve_paths=preserve_paths, outdir=outdir)
+    if not page_size or len(sections) <= page_size:
+        return [(dest, pycco.generate_html(source, sections,
+                                           preserve_paths=preserve_paths,
+                                           outdir=outdir), sections)]
+
+    count = (len(sections) + page_size - 1) // page_size
+    pages = []
+    for page in range(count):
+        page_sections = sections[page * page_size:(page + 1) * page_size]
+        html = pycco.generate_html(source, page_sections,
+                                   preserve_paths=preserve_paths, outdir=outdir,
+                                   pages=page_links(dest, count, page))
+        pages.append((pycco.page_destination(dest, page), html, page_sections))
+    return pages
+
+
+def render_pages(file_path, code, outdir, preserve_paths, language, page_size,
+                 cache_dir=None, index=None, granular=False):
+    """
+    Like `pycco.main._generate_documentation()`, but returns the pages of the
+    file as given by `generate_pages()`.
+    """
+    with trace.span("get_language", file_path):
+        language = pycco.get_language(file_path, code, language=language)
+    with trace.span("parse", file_path):
+        sections = pycco.parse(code, language)
+    highlighted = pycco.highlight(sections, language,
+                                  preserve_paths=preserve_paths, outdir=outdir,
+                                  cache_dir=cache_dir, index=index,
+                                  granular=granular)
+    with trace.span("template", file_path):
+        return generate_pages(file_path, highlighted, page_size,
+                              preserve_paths=preserve_paths, outdir=outdir)
+
+
+def remove_stale_pages(dest, count):
+    """
+    Remove the pages of `dest` after the first `count`, and their compressed
+    copies, left over from when the file had more of them.
+    """
+    from pycco import static
+    page = max(count, 1)
+    while True:
+        stale = pycco.page_destination(dest, page)
+        found = [name for name in [stale] + [stale + suffix for suffix in
+                                             sorted(static.SUFFIXES.values())]
+                 if path.exists(name)]
+        if not found:
+            break
+        for name in found:
+            os.remove(name)
+        page += 1
+
+
+def search_entry(source, pages, outdir):
+    """
+    Describe a file for the search index given its `(destination, html,
+    sections)` pages, like `pycco.main.search_entry()`. If there is more than
+    one page, the URLs of all of them are listed under `pages`, and the
+    headings on the pages after the first carry the URL of their page as a
+    third item.
+    """
+
+    entry = None
+    identifiers = set()
+    for dest, html, sections in pages:
+        page_entry = pycco.search_entry(source, dest, sections, outdir)
+        identifiers.update(page_entry["identifiers"])
+        if entry is None:
+            entry = page_entry
+            entry["pages"] = []
+        else:
+            entry["headings"].extend(heading + [page_entry["url"]]
+                                     for heading in page_entry["headings"])
+        entry["pages"].append(page_entry["url"])
+
+    entry["identifiers"] = sorted(identifiers)
+    if len(entry["pages"]) < 2:
+        del entry["pages"]
+    return entry
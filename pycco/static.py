@@ -0,0 +1,130 @@
+"""
+Preparing the output for static file servers.
+
+After every build, `process()` writes `pycco-etags.json` to the output
+directory. It lists every page, the stylesheet, the index pages and the search
+index with their size and a strong ETag made from a hash of their contents,
+so that a server or CDN can answer conditional requests without reading the
+files.
+
+Servers which compress pages on the fly spend CPU on every request for a big
+page. With `compress` set, each of those files also gets a gzipped copy next
+to it, ending in `.gz`, and a Brotli one ending in `.br` if the `brotli`
+module is installed, which servers such as nginx (`gzip_static`) send as
+they are. The copies are reproducible byte for byte.
+
+Only the files whose size or modification time changed since the last
+manifest was written are read, hashed and compressed again; the others keep
+their entries, and their compressed copies are left alone.
+"""
+
+import gzip
+import hashlib
+import io
+import json
+import os
+from os import path
+
+from pycco import main as pycco
+from pycco import trace
+
+ETAGS_NAME = "pycco-etags.json"
+
+# Every content encoding that compressed copies can be made in, by the suffix
+# of their file names.
+SUFFIXES = {"gzip": ".gz", "br": ".br"}
+
+
+def gzip_compress(data):
+    """
+    Gzip `data` at the highest level. No file name or time stamp is recorded,
+    so the same data always gives the same bytes.
+    """
+    buf = io.BytesIO()
+    with gzip.GzipFile(filename="", mode="wb", fileobj=buf, compresslevel=9,
+                       mtime=0) as f:
+        f.write(data)
+    return buf.getvalue()
+
+
+def encoders():
+    """
+    The `(encoding, compress)` pairs for every content encoding available:
+    gzip always, and Brotli if the `brotli` module is installed.
+    """
+    available = [("gzip", gzip_compress)]
+    try:
+        import brotli
+    except ImportError:
+        pass
+    else:
+        available.append(("br", brotli.compress))
+    return available
+
+
+def load_etags(outdir):
+    """
+    Read the ETags manifest for `outdir`, as a mapping of file names, relative
+    to `outdir`, to their entries. A missing or corrupt manifest is empty.
+    """
+    try:
+        with open(path.join(outdir, ETAGS_NAME), "rb") as f:
+            files = json.loads(f.read().decode("utf-8"))["files"]
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        return {}
+    return files if isinstance(files, dict) else {}
+
+
+def publish(outdir, filenames, compress=False):
+    """
+    Write the ETags manifest for the files `filenames` in `outdir`, given
+    relative to it, and, if `compress` is set, their compressed copies. Stale
+    compressed copies of files which changed are removed. Returns the
+    manifest's entries.
+    """
+
+    previous = load_etags(outdir)
+    codecs = encoders() if compress else []
+    wanted = sorted(encoding for encoding, _ in codecs)
+    files = {}
+    for name in sorted(set(name.replace(os.sep, "/") for name in filenames)):
+        filename = path.join(outdir, name)
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            continue
+
+        entry = previous.get(name)
+        if entry is not None and entry.get("size") == stat.st_size \
+           and entry.get("mtime") == stat.st_mtime \
+           and sorted(entry.get("encodings", {})) == wanted \
+           and all(path.exists(filename + SUFFIXES[encoding])
+                   for encoding in wanted):
+            files[name] = entry
+            continue
+
+        with trace.span("compress", name):
+            with open(filename, "rb") as f:
+                data = f.read()
+            entry = {
+                "etag": '"{}"'.format(hashlib.sha1(data).hexdigest()),
+                "size": len(data),
+                "mtime": stat.st_mtime,
+                "encodings": {},
+            }
+            for encoding, encode in codecs:
+                compressed = encode(data)
+                pycco.write_file(filename + SUFFIXES[encoding], compressed)
+                entry["encodings"][encoding] = len(compressed)
+            for encoding, suffix in SUFFIXES.items():
+                if encoding not in entry["encodings"]:
+                    try:
+                        os.remove(filename + suffix)
+                    except OSError:
+                        pass
+        files[name] = entry
+
+    pycco.write_file(path.join(outdir, ETAGS_NAME),
+                     json.dumps({"files": files}, indent=1,
+                                sort_keys=True).encode("utf-8"))
+    return files
@@ -0,0 +1,187 @@
+"""
+Documenting sources too big to hold in memory.
+
+`stream_documentation()` produces the same page as
+`pycco.main.generate_documentation()`, but reads the source, highlights it
+and writes the page a chunk at a time: lines are decoded as they are read,
+sections are yielded by `pycco.main.parse_iter()` as soon as they are
+complete, batches of about `STREAM_CHUNK_SIZE` characters of code go through
+Pygments together, and the page template is rendered one section at a time.
+The only difference is that code running on for more than
+`STREAM_SECTION_SIZE` characters without a comment is cut into several
+sections. Memory use stays the same however big the source gets, which
+matters for generated sources hundreds of megabytes long. `process()` streams
+every source bigger than `STREAM_THRESHOLD` bytes.
+"""
+
+import filecmp
+import os
+import re
+import threading
+from os import path
+
+from pycco import main as pycco
+from pycco import trace
+from pycco.compat import pycco_replace, pycco_zip_longest
+
+# Matches the block of the page template that is repeated for every section.
+sections_block_matcher = re.compile(
+    r'^[ \t]*\{\{#sections\}\}[ \t]*\n(.*?)^[ \t]*\{\{/sections\}\}[ \t]*\n',
+    re.M | re.S)
+
+# The empty span Pygments starts its output with.
+empty_span = "<span></span>"
+
+# The parsed parts of each template, as returned by `get_templates()`.
+_templates = {}
+
+
+def read_lines(f, encoding="utf8", chunk_size=None):
+    """
+    Decode the binary file `f` a chunk at a time, yielding the same lines as
+    splitting its whole decoded contents on line feeds would.
+    """
+
+    import codecs
+    chunk_size = chunk_size or pycco.STREAM_CHUNK_SIZE
+    decoder = codecs.getincrementaldecoder(encoding)()
+    pending = []
+    while True:
+        chunk = f.read(chunk_size)
+        lines = decoder.decode(chunk, final=not chunk).split("\n")
+        if len(lines) > 1:
+            pending.append(lines[0])
+            yield "".join(pending)
+            for line in lines[1:-1]:
+                yield line
+            pending = []
+        pending.append(lines[-1])
+        if not chunk:
+            break
+    yield "".join(pending)
+
+
+def highlight_iter(sections, language, chunk_size=None, **kwargs):
+    """
+    Highlight a stream of sections like `pycco.main.highlight()` does, passing
+    them to Pygments in batches of about `chunk_size` characters of code. Each
+    batch is highlighted on its own, so code which is still inside a string or
+    a comment at the end of a batch may come out differently than it would in
+    a single pass.
+    """
+
+    chunk_size = chunk_size or pycco.STREAM_CHUNK_SIZE
+
+    def highlight_batch(batch, num, last):
+        with trace.span("highlight"):
+            fragments = pycco.highlight_code(
+                language["divider_text"].join(section["code_text"].rstrip()
+                                              for section in batch), language)
+            # Only the start of the whole file keeps the empty span, and only
+            # its end keeps the trailing newlines.
+            if num and fragments[0].startswith(empty_span):
+                fragments[0] = fragments[0][len(empty_span):]
+            if not last:
+                fragments[-1] = fragments[-1].rstrip("\n")
+        zipped = pycco_zip_longest(fragments, batch,
+                                   range(num, num + len(batch)), fillvalue="")
+        with trace.span("markdown"):
+            return [pycco.highlight_section(*z, **kwargs) for z in zipped]
+
+    batch, size, num = [], 0, 0
+    for section in sections:
+        if batch and size + len(section["code_text"]) > chunk_size:
+            for highlighted in highlight_batch(batch, num, False):
+                yield highlighted
+            num += len(batch)
+            batch, size = [], 0
+        batch.append(section)
+        size += len(section["code_text"])
+
+    if batch:
+        for highlighted in highlight_batch(batch, num, True):
+            yield highlighted
+
+
+def get_templates(template=pycco.HTML_RESOURCES):
+    """
+    Get the renderer and the parsed parts of `template` before, inside and
+    after its `{{#sections}}` block, so that a page can be rendered one
+    section at a time.
+    """
+
+    if template not in _templates:
+        import pystache
+        match = sections_block_matcher.search(template)
+        renderer, _ = pycco.get_template(template)
+        _templates[template] = (renderer,
+                                pystache.parse(template[:match.start()]),
+                                pystache.parse(match.group(1)),
+                                pystache.parse(template[match.end():]))
+    return _templates[template]
+
+
+def stream_documentation(source, outdir=None, preserve_paths=True,
+                         language=None, encoding="utf8", index=None):
+    """
+    Generate the documentation for a source file, writing it straight to its
+    destination as it is rendered. Like `pycco.main.write_file()`, the page is
+    written under a temporary name and only replaces the old one if it
+    changed. Returns the number of bytes in the page and its search entry.
+    """
+
+    if not outdir:
+        raise TypeError("Missing the required 'outdir' keyword argument.")
+
+    dest = pycco.destination(source, preserve_paths=preserve_paths, outdir=outdir)
+    pycco.ensure_directory(path.dirname(dest))
+    context = {
+        "title": path.basename(source),
+        "stylesheet": path.relpath(path.join(outdir, pycco.stylesheet_name()),
+                                   path.split(dest)[0]),
+    }
+    renderer, head, body, tail = get_templates()
+    search = pycco.search_entry(source, dest, [], outdir)
+    identifiers = set()
+    size = 0
+
+    temp = "{}.{}.{}.tmp".format(dest, os.getpid(),
+                                 threading.current_thread().ident)
+    try:
+        with open(source, "rb") as f, open(temp, "wb") as out:
+            with trace.span("get_language", source):
+                sample = f.read(pycco.STREAM_CHUNK_SIZE).decode(encoding, "ignore")
+                language = pycco.get_language(source, sample, language=language)
+                f.seek(0)
+
+            def write(html):
+                data = html.encode("utf-8")
+                out.write(data)
+                return len(data)
+
+            size += write(renderer.render(head, context))
+            sections = pycco.parse_iter(read_lines(f, encoding), language,
+                                        max_size=pycco.STREAM_SECTION_SIZE)
+            for section in highlight_iter(sections, language,
+                                          preserve_paths=preserve_paths,
+                                          outdir=outdir, index=index):
+                html = renderer.render(body, context, section)
+                entry = pycco.search_entry(source, dest, [section], outdir)
+                search["headings"].extend(entry["headings"])
+                identifiers.update(entry["identifiers"])
+                size += write(html)
+            size += write(renderer.render(tail, context))
+
+        search["identifiers"] = sorted(identifiers)
+        if path.exists(dest) and filecmp.cmp(temp, dest, shallow=False):
+            os.remove(temp)
+        else:
+            pycco_replace(temp, dest)
+    except BaseException:
+        try:
+            os.remove(temp)
+        except OSError:
+            pass
+        raise
+
+    return size, search
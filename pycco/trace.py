@@ -0,0 +1,125 @@
+"""
+Timing of the individual stages of a build.
+
+While tracing is switched on with `start()`, every stage of documenting a file
+(reading it, working out its language, parsing, highlighting, rendering the
+comments and the template, and writing the page) is recorded as a span in the
+Chrome trace-event format, tagged with the process and thread that ran it. The
+spans can be saved with `Tracer.write()` and opened in `chrome://tracing` or
+Perfetto, or summarised with `Tracer.summary()`.
+
+Functions registered with `add_hook()` are called with each span as it is
+recorded, whether or not a tracer is running.
+"""
+
+import collections
+import contextlib
+import json
+import os
+import threading
+import time
+
+# The tracer recording spans in this process, if any.
+_tracer = None
+
+_hooks = []
+
+
+class Tracer(object):
+
+    """Collects trace events."""
+
+    def __init__(self):
+        self.events = []
+
+    def write(self, filename):
+        """Save the events as a Chrome trace file."""
+        with open(filename, "w") as f:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, f)
+
+    def summary(self, limit=10):
+        """
+        Describe the `limit` slowest files, and the total time spent in each
+        stage, as a list of lines.
+        """
+        files = []
+        stages = collections.defaultdict(float)
+        for event in self.events:
+            seconds = event["dur"] / 1e6
+            if event["name"] == "file":
+                files.append((seconds, event["args"].get("source")))
+            else:
+                stages[event["name"]] += seconds
+
+        lines = ["Slowest files:"]
+        for seconds, source in sorted(files, reverse=True)[:limit]:
+            lines.append("  {:10.4f}s  {}".format(seconds, source))
+        lines.append("Time per stage:")
+        for name, seconds in sorted(stages.items(), key=lambda s: -s[1]):
+            lines.append("  {:10.4f}s  {}".format(seconds, name))
+        return lines
+
+
+def start():
+    """Start recording spans in this process, returning the new `Tracer`."""
+    global _tracer
+    _tracer = Tracer()
+    return _tracer
+
+
+def stop():
+    """Stop recording spans, returning the `Tracer` which recorded them."""
+    global _tracer
+    tracer, _tracer = _tracer, None
+    return tracer
+
+
+def enabled():
+    """Whether anyone is listening for spans in this process."""
+    return _tracer is not None or bool(_hooks)
+
+
+def add_hook(hook):
+    """Call `hook(event)` for every span recorded from now on."""
+    _hooks.append(hook)
+
+
+def remove_hook(hook):
+    _hooks.remove(hook)
+
+
+def record(event):
+    """
+    Record an event, which may have come from another process.
+    """
+    if _tracer is not None:
+        _tracer.events.append(event)
+    for hook in _hooks:
+        hook(event)
+
+
+@contextlib.contextmanager
+def span(name, source=None):
+    """
+    Record the time taken by the body of the `with` statement as a stage called
+    `name`, while working on `source`. Does nothing unless someone is listening.
+    """
+    if _tracer is None and not _hooks:
+        yield
+        return
+
+    start = time.time()
+    try:
+        yield
+    finally:
+        end = time.time()
+        record({
+            "name": name,
+            "cat": "pycco",
+            "ph": "X",
+            "ts": start * 1e6,
+            "dur": (end - start) * 1e6,
+            "pid": os.getpid(),
+            "tid": threading.current_thread().ident,
+            "args": {"source": source},
+        })
@@ -0,0 +1,147 @@
+"""
+Building only the sources that changed since a git revision.
+
+`pycco --since REV` asks `git diff --name-status -M REV` which files were
+added, modified, renamed or deleted between `REV` and the working tree, and
+counts untracked files as added. Only the sources among them are documented
+again. The pages of deleted sources are removed, and those of renamed
+sources are moved to their new destination before the source is documented
+again, so that a page which comes out the same is not rewritten. Paginated
+pages and compressed copies go along with them.
+
+For a merge request, pass the revision it branched off, such as the output
+of `git merge-base origin/main HEAD`.
+"""
+
+import collections
+import os
+import subprocess
+from os import path
+
+from pycco import main as pycco
+from pycco.compat import pycco_replace
+
+# What changed since a revision: the sources which were added or modified,
+# those which were deleted, and `(old, new)` pairs for those which were
+# renamed, whose new name is also listed as changed. Paths are relative to the
+# current directory.
+Changes = collections.namedtuple("Changes", ["changed", "deleted", "renamed"])
+
+
+def git(args, cwd=None):
+    """Run `git` with `args` in `cwd`, returning its output as text."""
+    try:
+        process = subprocess.Popen(["git"] + args, cwd=cwd,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE)
+    except OSError as e:
+        raise ValueError("Can't run git: {}".format(e))
+    out, err = process.communicate()
+    if process.returncode:
+        raise ValueError("git {} failed: {}".format(
+            args[0], err.decode("utf-8", "replace").strip()))
+    return out.decode("utf-8")
+
+
+def changes_since(rev, cwd=None):
+    """List the `Changes` between the revision `rev` and the working tree."""
+
+    cwd = cwd or os.getcwd()
+    top = git(["rev-parse", "--show-toplevel"], cwd).strip()
+
+    def local(name):
+        return path.relpath(path.join(top, name), cwd)
+
+    changed, deleted, renamed = [], [], []
+    fields = git(["diff", "--name-status", "-M", "-z", rev, "--"], cwd).split("\0")
+    i = 0
+    while i < len(fields) - 1:
+        status = fields[i]
+        if status[0] in "RC":
+            old, new = local(fields[i + 1]), local(fields[i + 2])
+            if status[0] == "R":
+                renamed.append((old, new))
+            changed.append(new)
+            i += 3
+        else:
+            name = local(fields[i + 1])
+            (deleted if status[0] == "D" else changed).append(name)
+            i += 2
+
+    untracked = git(["ls-files", "--others", "--exclude-standard", "--full-name",
+                     "-z", ":/"], cwd)
+    changed.extend(local(name) for name in untracked.split("\0") if name)
+    return Changes(changed, deleted, renamed)
+
+
+def outputs(dest):
+    """Every file that exists for the page `dest`: its pages and their copies."""
+    from pycco import static
+    found = []
+    page = 0
+    while path.exists(pycco.page_destination(dest, page)):
+        found.append(pycco.page_destination(dest, page))
+        page += 1
+    return [name + suffix for name in found
+            for suffix in [""] + sorted(static.SUFFIXES.values())
+            if path.exists(name + suffix)]
+
+
+def prepare_build(changes, sources, outdir, preserve_paths=True, compress=False,
+                  index=None):
+    """
+    Work out which of `sources` have to be documented again after `changes`,
+    first removing the pages of deleted sources and moving those of renamed
+    ones. Pages which another of `sources` also maps to are left alone. The
+    project index is brought up to date if any page went away, and deleted and
+    renamed sources are removed from the `CrossrefIndex`, if one is given.
+    """
+
+    def key(name):
+        return path.normcase(path.abspath(name))
+
+    def dest(name):
+        return pycco.destination(name, preserve_paths=preserve_paths,
+                                 outdir=outdir)
+
+    by_key = dict((key(source), source) for source in sources)
+    claimed = set(dest(source) for source in sources)
+    gone = set()
+    moved = False
+
+    for name in changes.deleted:
+        gone.add(key(name))
+        if index is not None:
+            index.remove(name)
+        if dest(name) not in claimed:
+            for filename in outputs(dest(name)):
+                os.remove(filename)
+                moved = True
+
+    for old, new in changes.renamed:
+        gone.add(key(old))
+        if index is not None:
+            index.remove(old)
+        if dest(old) in claimed:
+            continue
+        if key(new) not in by_key:
+            for filename in outputs(dest(old)):
+                os.remove(filename)
+                moved = True
+            continue
+        # Pages and copies share the name of the first page, up to `.html`.
+        old_stem, new_stem = dest(old)[:-len(".html")], dest(new)[:-len(".html")]
+        pycco.ensure_directory(path.dirname(new_stem))
+        for filename in outputs(dest(old)):
+            pycco_replace(filename, new_stem + filename[len(old_stem):])
+            moved = True
+
+    # The search index leaves out pages which no longer exist by itself.
+    entries = pycco.load_search_index(outdir)
+    if moved or any(key(source) in gone for source in entries):
+        pycco.update_project(outdir, dict(
+            (source, entry) for source, entry in entries.items()
+            if key(source) not in gone), compress=compress)
+
+    changed = set(key(name) for name in changes.changed)
+    return [source for source in sources if key(source) in changed]
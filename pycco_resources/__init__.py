@@ -123,6 +123,14 @@ div.code {
 div.clearall {
     clear: both;
 }
+div.pages {
+  font: 12px Arial;
+  min-height: 0;
+  padding-top: 15px;
+}
+  .pages a, .pages strong {
+    padding: 0 4px;
+  }
 
 
 /*---------------------- Syntax Highlighting -----------------------------*/
@@ -218,6 +226,16 @@ html = """\
     <div class='docs'><h1>{{ title }}</h1></div>
   </div>
   <div class='clearall'>
+  {{#pages?}}
+  <div class='section'>
+    <div class='docs pages'>
+      {{#pages}}
+      {{#current}}<strong>{{ number }}</strong>{{/current}}{{^current}}<a href="{{ url }}">{{ number }}</a>{{/current}}
+      {{/pages}}
+    </div>
+  </div>
+  <div class='clearall'></div>
+  {{/pages?}}
   {{#sections}}
   <div class='section' id='section-{{ num }}'>
     <div class='docs'>
@@ -232,6 +250,54 @@ html = """\
   </div>
   <div class='clearall'></div>
   {{/sections}}
+  {{#pages?}}
+  <div class='section'>
+    <div class='docs pages'>
+      {{#pages}}
+      {{#current}}<strong>{{ number }}</strong>{{/current}}{{^current}}<a href="{{ url }}">{{ number }}</a>{{/current}}
+      {{/pages}}
+    </div>
+  </div>
+  <div class='clearall'></div>
+  {{/pages?}}
+</div>
+</body>
+"""
+
+index_html = """\
+<!DOCTYPE html>
+<html>
+<head>
+  <meta http-equiv="content-type" content="text/html;charset=utf-8">
+  <title>{{ title }}</title>
+  <link rel="stylesheet" href="{{ stylesheet }}">
+</head>
+<body>
+<div id='container'>
+  <div class='section'>
+    <div class='docs'><h1>{{ title }}</h1></div>
+  </div>
+  <div class='clearall'></div>
+  {{#packages}}
+  <div class='section'>
+    <div class='docs'>
+      {{#url}}
+      <h2><a href="{{ url }}">{{ name }}</a> ({{ count }})</h2>
+      {{/url}}
+      {{^url}}
+      <h2>{{ name }}</h2>
+      {{/url}}
+      {{#files?}}
+      <ul>
+        {{#files}}
+        <li><a class="source" href="{{ url }}">{{ title }}</a></li>
+        {{/files}}
+      </ul>
+      {{/files?}}
+    </div>
+  </div>
+  <div class='clearall'></div>
+  {{/packages}}
 </div>
 </body>
 """
@@ -0,0 +1,21 @@
+import pytest
+
+
+def pytest_addoption(parser):
+    parser.addoption('--perf', action='store_true',
+                     help='Also run the slow tests of how time and memory '
+                          'grow with the size of a source, in every language')
+
+
+def pytest_configure(config):
+    config.addinivalue_line(
+        'markers', 'perf: slow scaling test, only run with --perf')
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption('--perf'):
+        return
+    skip = pytest.mark.skip(reason='needs --perf')
+    for item in items:
+        if 'perf' in item.keywords:
+            item.add_marker(skip)
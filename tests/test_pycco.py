@@ -1,9 +1,12 @@
+import json
 import os
+import subprocess
+import sys
 import tempfile
 import time
 
 import pytest
-from hypothesis import given, example
+from hypothesis import given, example, settings
 from hypothesis.strategies import text, booleans, choices, none
 
 import pycco.main as p
@@ -13,6 +16,11 @@ PYTHON = p.languages['.py']
 PYCCO_SOURCE = 'pycco/main.py'
 FOO_FUNCTION = """def foo():\n    return True"""
 
+# Importing `pycco.main` must not pull in the rendering dependencies, and should
+# stay within this many seconds even on a slow machine.
+IMPORT_TIME_BUDGET = 0.5
+HEAVY_MODULES = ('markdown', 'pygments', 'pystache')
+
 
 def get_language(choice):
     return choice(list(p.languages.values()))
@@ -85,6 +93,25 @@ def test_get_language_bad_code(code):
     assert p.get_language(source, code) == PYTHON
 
 
+def test_get_language_detects_unknown_extensions():
+    from pycco import detect
+    detect.detect_cache.clear()
+    assert p.get_language("SConstruct", "env = Environment()\n") == PYTHON
+    assert p.get_language("tool", "#!/usr/bin/env -S node --harmony\n") \
+        == p.languages[".js"]
+    assert p.get_language("tool", "#!/usr/local/bin/ruby2.7\n") == p.languages[".rb"]
+    assert p.get_language("script.txt", "x = 1\n# vim: set ft=lua:\n") \
+        == p.languages[".lua"]
+    assert p.get_language("script.txt", "-- -*- mode: haskell -*-\n") \
+        == p.languages[".hs"]
+    assert p.get_language("header.h", "#include <stdio.h>\nint main(void);\n") \
+        == p.languages[".c"]
+
+    p.get_language("SConstruct", "env = Environment()\n")
+    info = detect.detect_cache.info()
+    assert (info.hits, info.misses) == (1, 6)
+
+
 @given(text(max_size=64))
 def test_ensure_directory(dir_name):
     tempdir = os.path.join(tempfile.gettempdir(), str(int(time.time())), dir_name)
@@ -105,6 +132,7 @@ def test_generate_documentation():
     p.generate_documentation(PYCCO_SOURCE, outdir=tempfile.gettempdir())
 
 
+@settings(deadline=None)
 @given(booleans(), choices())
 def test_process(preserve_paths, choice):
     lang_name = choice([l["name"] for l in p.languages.values()])
@@ -128,3 +156,960 @@ def x():
 
     assert docs_code_tuple_list[0]['docs_text'] == ''
     assert "#" not in docs_code_tuple_list[1]['docs_text']
+
+
+def test_process_parallel_matches_serial():
+    sources = [PYCCO_SOURCE, 'pycco/compat.py']
+    serial_dir = tempfile.mkdtemp()
+    parallel_dir = tempfile.mkdtemp()
+    p.process(sources, outdir=serial_dir)
+    p.process(sources, outdir=parallel_dir, jobs=2)
+
+    for source in sources:
+        serial = p.destination(source, outdir=serial_dir)
+        parallel = p.destination(source, outdir=parallel_dir)
+        with open(serial, 'rb') as a, open(parallel, 'rb') as b:
+            assert a.read() == b.read()
+
+
+def test_process_skips_unchanged_sources(capsys):
+    outdir = tempfile.mkdtemp()
+    source = os.path.join(outdir, 'example.py')
+    with open(source, 'w') as f:
+        f.write(FOO_FUNCTION)
+
+    p.process([source], outdir=outdir)
+    assert os.path.exists(os.path.join(outdir, p.MANIFEST_NAME))
+    capsys.readouterr()
+
+    p.process([source], outdir=outdir)
+    out = capsys.readouterr()[0]
+    assert 'pycco = ' not in out
+    assert 'skipped 1 unchanged' in out
+
+    with open(source, 'a') as f:
+        f.write('\n# A new comment\n')
+    p.process([source], outdir=outdir)
+    assert 'pycco = ' in capsys.readouterr()[0]
+
+    p.process([source], outdir=outdir, force=True)
+    assert 'pycco = ' in capsys.readouterr()[0]
+
+    # Pages linking to another stylesheet, such as the plain pycco.css of
+    # older versions, are rendered again.
+    manifest_path = os.path.join(outdir, p.MANIFEST_NAME)
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    manifest['files'][source]['stylesheet'] = 'pycco.css'
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f)
+    p.process([source], outdir=outdir)
+    assert 'pycco = ' in capsys.readouterr()[0]
+
+    # Forcing some of the sources keeps the entries of the others.
+    p.process([source, 'pycco/compat.py'], outdir=outdir)
+    p.process(['pycco/compat.py'], outdir=outdir, force=True)
+    capsys.readouterr()
+    p.process([source, 'pycco/compat.py'], outdir=outdir)
+    assert 'skipped 2 unchanged' in capsys.readouterr()[0]
+
+
+def test_process_iter_streams_results():
+    outdir = tempfile.mkdtemp()
+    sources = iter([PYCCO_SOURCE, 'pycco/compat.py'])
+    results = p.process_iter(sources, outdir=outdir)
+    first = next(results)
+    assert first.source == PYCCO_SOURCE
+    assert first.destination == p.destination(PYCCO_SOURCE, outdir=outdir)
+    assert first.size == os.path.getsize(first.destination)
+    assert first.elapsed >= 0
+    assert not first.skipped
+    assert [r.source for r in results] == ['pycco/compat.py']
+
+    assert all(r.skipped for r in p.process_iter([PYCCO_SOURCE], outdir=outdir))
+
+
+def test_process_leaves_identical_outputs_alone():
+    outdir = tempfile.mkdtemp()
+    p.process([PYCCO_SOURCE], outdir=outdir)
+    outputs = [p.destination(PYCCO_SOURCE, outdir=outdir),
+               os.path.join(outdir, p.stylesheet_name())]
+    for output in outputs:
+        os.utime(output, (0, 0))
+
+    p.process([PYCCO_SOURCE], outdir=outdir, force=True)
+    assert [os.path.getmtime(output) for output in outputs] == [0, 0]
+    assert not [f for f in os.listdir(outdir) if f.endswith('.tmp')]
+
+    assert p.write_file(outputs[1], b'changed')
+    assert not p.write_file(outputs[1], b'changed')
+    with open(outputs[1], 'rb') as f:
+        assert f.read() == b'changed'
+
+
+def test_process_writes_compressed_copies_and_etags():
+    import gzip
+    import hashlib
+    from pycco import static
+    outdir = tempfile.mkdtemp()
+    source = 'pycco/compat.py'
+    p.process([source], outdir=outdir, compress=True)
+
+    page = p.destination(source, outdir=outdir)
+    url = 'pycco/compat.html'
+    with open(page, 'rb') as f:
+        html = f.read()
+    with gzip.open(page + '.gz', 'rb') as f:
+        assert f.read() == html
+    assert p.stylesheet_name().encode('utf-8') in html
+    assert os.path.exists(os.path.join(outdir, p.stylesheet_name() + '.gz'))
+
+    etags = static.load_etags(outdir)
+    assert sorted(etags) == sorted([p.stylesheet_name(), p.STYLESHEET_NAME, url,
+                                    'index.html', p.SEARCH_INDEX_NAME])
+    assert etags[url]['etag'] == '"{}"'.format(hashlib.sha1(html).hexdigest())
+    assert etags[url]['size'] == len(html)
+
+    # Unchanged files are not compressed again.
+    os.utime(page + '.gz', (0, 0))
+    p.process([source], outdir=outdir, compress=True, force=True)
+    assert os.path.getmtime(page + '.gz') == 0
+
+    p.process([source], outdir=outdir)
+    assert not os.path.exists(page + '.gz')
+    assert static.load_etags(outdir)[url]['encodings'] == {}
+
+    # The stylesheets of other versions go away, along with their copies, but
+    # the plain pycco.css is kept for anything linking to it.
+    for name in ('pycco.0123456789ab.css', 'pycco.0123456789ab.css.gz'):
+        with open(os.path.join(outdir, name), 'w') as f:
+            f.write('old')
+    p.process([source], outdir=outdir, force=True)
+    assert sorted(f for f in os.listdir(outdir) if f.endswith(('.css', '.css.gz'))) \
+        == sorted([p.STYLESHEET_NAME, p.stylesheet_name()])
+
+
+def test_process_iter_raises_read_errors_in_order():
+    outdir = tempfile.mkdtemp()
+    results = p.process_iter([PYCCO_SOURCE, os.path.join(outdir, 'missing.py')],
+                             outdir=outdir)
+    assert next(results).source == PYCCO_SOURCE
+    with pytest.raises(IOError):
+        next(results)
+
+
+def test_stream_documentation_matches_generate_documentation(monkeypatch):
+    from pycco import stream
+    outdir = tempfile.mkdtemp()
+    expected = p.generate_documentation(PYCCO_SOURCE, outdir=outdir)
+    # Tiny chunks, so that the source is read and highlighted in many pieces.
+    monkeypatch.setattr(p, 'STREAM_CHUNK_SIZE', 100)
+    size, search = stream.stream_documentation(PYCCO_SOURCE, outdir=outdir)
+
+    dest = p.destination(PYCCO_SOURCE, outdir=outdir)
+    with open(dest, 'rb') as f:
+        assert f.read() == expected
+    assert size == len(expected)
+    with open(PYCCO_SOURCE) as f:
+        sections = p.highlight(p.parse(f.read(), PYTHON), PYTHON, outdir=outdir)
+    assert search == p.search_entry(PYCCO_SOURCE, dest, sections, outdir)
+
+
+def test_process_streams_big_sources(monkeypatch):
+    from pycco import stream
+    outdir = tempfile.mkdtemp()
+    streamed = []
+    monkeypatch.setattr(p, 'STREAM_THRESHOLD', 1000)
+    monkeypatch.setattr(stream, 'stream_documentation',
+                        lambda source, **kwargs: streamed.append(source) or (0, {}))
+    list(p.process_iter([PYCCO_SOURCE, 'pycco/__init__.py'], outdir=outdir))
+    assert streamed == [PYCCO_SOURCE]
+
+
+def test_sections_behave_like_dicts():
+    sections = p.parse(FOO_FUNCTION, PYTHON)
+    section = sections[0]
+    assert isinstance(section, p.Section)
+    assert 'docs_html' not in section
+    assert section.get('docs_html', 'missing') == 'missing'
+    with pytest.raises(KeyError):
+        section['docs_html']
+    with pytest.raises(KeyError):
+        section['anything'] = 1
+
+    highlighted = p.highlight(sections, PYTHON, outdir=tempfile.gettempdir())
+    # Highlighting leaves the parsed sections alone.
+    assert highlighted[0] is not section
+    assert set(section.keys()) == {'docs_text', 'code_text'}
+    again = p.highlight(sections, PYTHON, outdir=tempfile.gettempdir())
+    assert again[0] is not highlighted[0] and again == highlighted
+
+    section = highlighted[0]
+    assert set(section.keys()) == {'docs_text', 'code_text', 'docs_html',
+                                   'code_html', 'num'}
+    assert dict(section.items())['num'] == 0
+    assert p.Section(**dict(section.items())) == section
+
+
+def test_find_sources_walks_directories_and_patterns():
+    from pycco.discovery import find_sources
+    root = tempfile.mkdtemp()
+    for name in ['src/a.py', 'src/pkg/b.py', 'src/pkg/c.js', 'src/pkg/notes.txt',
+                 'src/pkg/b_test.py', 'src/pkg/keep_test.py', 'build/gen.py',
+                 '.git/hook.py']:
+        name = os.path.join(root, name)
+        if not os.path.isdir(os.path.dirname(name)):
+            os.makedirs(os.path.dirname(name))
+        open(name, 'w').close()
+    ignore = os.path.join(root, '.pyccoignore')
+    with open(ignore, 'w') as f:
+        f.write('# generated\nbuild/\n*_test.py\n!keep_test.py\n')
+
+    def found(*args, **kwargs):
+        sources = find_sources([os.path.join(root, arg) for arg in args],
+                               extensions=p.languages, **kwargs)
+        return [os.path.relpath(source, root) for source in sources]
+
+    assert found('.') == ['build/gen.py', 'src/a.py', 'src/pkg/b.py', 'src/pkg/b_test.py',
+                          'src/pkg/c.js', 'src/pkg/keep_test.py']
+    assert found('.', exclude_from=[ignore]) == ['src/a.py', 'src/pkg/b.py', 'src/pkg/c.js',
+                                                 'src/pkg/keep_test.py']
+    assert found('src', exclude=['pkg/']) == ['src/a.py']
+    assert found('src/**/*.py', exclude=['*_test.py']) == ['src/a.py', 'src/pkg/b.py']
+    assert found('src/*.py', 'src/pkg/notes.txt') == ['src/a.py', 'src/pkg/notes.txt']
+
+
+def test_process_many_files():
+    # The old recursive implementation ran out of stack on long source lists.
+    outdir = tempfile.mkdtemp()
+    sources = []
+    for i in range(1200):
+        source = os.path.join(outdir, 'module_{}.py'.format(i))
+        with open(source, 'w') as f:
+            f.write('x = 1\n')
+        sources.append(source)
+    results = list(p.process_iter(sources, outdir=outdir))
+    assert len(results) == len(sources)
+
+
+def test_parse_multi_line_comment_after_code():
+    code = 'x = 1\ny = 2\n"""\nSome docs\n"""\nz = 3'
+    parsed = p.parse(code, PYTHON)
+    assert parsed[0] == {"docs_text": "\nSome docs\n\n", "code_text": "x = 1\ny = 2"}
+    assert parsed[1] == {"docs_text": "", "code_text": "z = 3\n"}
+
+
+def run_python(script):
+    return subprocess.check_output([sys.executable, '-c', script]).decode('utf-8')
+
+
+def test_import_is_lazy():
+    out = run_python(
+        "import sys, time\n"
+        "start = time.time()\n"
+        "import pycco.main\n"
+        "print(time.time() - start)\n"
+        "print(','.join(m for m in {!r} if m in sys.modules))\n".format(HEAVY_MODULES))
+    elapsed, loaded = out.splitlines()
+    assert loaded == ''
+    assert float(elapsed) < IMPORT_TIME_BUDGET
+
+
+def test_help_does_not_load_pygments():
+    out = run_python(
+        "import sys\n"
+        "sys.argv = ['pycco', '--help']\n"
+        "import pycco.main\n"
+        "try:\n"
+        "    pycco.main.main()\n"
+        "except SystemExit:\n"
+        "    pass\n"
+        "print('pygments' in sys.modules)\n")
+    assert out.splitlines()[-1] == 'False'
+
+
+def test_lexers_are_built_on_first_use():
+    language = dict(PYTHON)
+    language.pop('lexer', None)
+    lexer = p.get_lexer(language)
+    assert lexer.name.lower() == 'python'
+    assert p.get_lexer(language) is lexer
+
+
+def test_generate_html_keeps_mustaches_in_code():
+    source = 'x = "{{ title }} {{{ docs_html }}}"\n'
+    html = p._generate_documentation('example.py', source, tempfile.gettempdir(),
+                                     True, None).decode('utf-8')
+    assert '{{ title }}' in html
+    assert '{{{ docs_html }}}' in html
+    assert p.get_template() is p.get_template()
+
+
+def test_lru_cache_evicts_least_recently_used():
+    from pycco.cache import LRUCache
+    cache = LRUCache(2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert 'b' not in cache
+    assert cache.get('b') is None
+    assert cache.info() == (1, 1, 2, 2)
+
+
+def test_markdown_is_cached():
+    p.markdown_cache.clear()
+    assert p.markdown('*hello*') == '<p><em>hello</em></p>'
+    assert p.markdown('*hello*') == '<p><em>hello</em></p>'
+    assert p.markdown('plain') == '<p>plain</p>'
+    info = p.markdown_cache.info()
+    assert (info.hits, info.misses) == (1, 2)
+
+
+def test_highlight_uses_disk_cache():
+    cache_dir = tempfile.mkdtemp()
+    outdir = tempfile.gettempdir()
+
+    def code_html(**kwargs):
+        sections = p.parse(FOO_FUNCTION, PYTHON)
+        return [s['code_html'] for s in p.highlight(sections, PYTHON, outdir=outdir,
+                                                    **kwargs)]
+
+    expected = code_html()
+    assert 'foo' in expected[0]
+    assert code_html(cache_dir=cache_dir) == expected
+
+    # A second run is served from the cache, without touching Pygments.
+    highlight_code = p.highlight_code
+    p.highlight_code = None
+    try:
+        assert code_html(cache_dir=cache_dir) == expected
+    finally:
+        p.highlight_code = highlight_code
+
+
+def test_cache_key_does_not_import_pygments():
+    out = run_python(
+        "import sys\n"
+        "from pycco import cache\n"
+        "print(cache.pygments_version())\n"
+        "print('pygments' in sys.modules)\n")
+    import pygments
+    assert out.splitlines() == [pygments.__version__, 'False']
+
+
+def test_highlight_granular_only_highlights_changed_sections():
+    outdir = tempfile.gettempdir()
+    code = "".join("# Step {0}\nstep_{0}()\n".format(i) for i in range(6))
+    p.section_cache.clear()
+    p.highlight(p.parse(code, PYTHON), PYTHON, outdir=outdir, granular=True)
+
+    def code_html(code, **kwargs):
+        sections = p.highlight(p.parse(code, PYTHON), PYTHON, outdir=outdir, **kwargs)
+        return [section['code_html'] for section in sections]
+
+    edited = code.replace("step_3()", "step_3(again=True)")
+    highlighted = []
+    highlight_code = p.highlight_code
+
+    def spy(code, language):
+        highlighted.append(code)
+        return highlight_code(code, language)
+
+    p.highlight_code = spy
+    try:
+        granular = code_html(edited, granular=True)
+    finally:
+        p.highlight_code = highlight_code
+    assert granular == code_html(edited)
+    # The edited section went through Pygments in a single call, along with the
+    # first and last sections, and none of the others did.
+    assert len(highlighted) == 1
+    assert "step_3(again=True)" in highlighted[0]
+    assert "step_0()" in highlighted[0] and "step_5()" in highlighted[0]
+    assert "step_2()" not in highlighted[0]
+
+    # Opening a string changes how the rest of the file is highlighted.
+    broken = code.replace("step_3()", 'step_3("""')
+    assert code_html(broken, granular=True) == code_html(broken)
+
+
+def test_disk_cache_evicts_oldest_entries(monkeypatch):
+    from pycco.cache import DiskCache
+    cache = DiskCache(tempfile.mkdtemp(), max_size=100)
+    cache.put(['old'], 'x' * 60)
+    os.utime(cache.path(['old']), (0, 0))
+    cache.put(['new'], 'y' * 60)
+    cache.evict()
+    assert cache.get(['old']) is None
+    assert cache.get(['new']) == 'y' * 60
+    assert cache.size() == 62
+
+    # The cache is only looked through again once it outgrows its size.
+    def walk(directory):
+        raise AssertionError('walked ' + directory)
+    monkeypatch.setattr(os, 'walk', walk)
+    cache.evict()
+    cache.put(['more'], 'z' * 30)
+    assert cache.size() == 94
+    cache.evict()
+    monkeypatch.undo()
+    cache.put(['most'], 'z' * 30)
+    os.utime(cache.path(['new']), (0, 0))
+    cache.evict()
+    assert cache.get(['new']) is None
+    assert cache.size() <= 100
+
+
+def test_change_batcher_debounces_events():
+    batcher = p.ChangeBatcher(debounce=0.05)
+    batcher.add('b.py')
+    batcher.add('a.py')
+    batcher.add('b.py')
+    assert batcher.pop_batch() == []
+    time.sleep(0.1)
+    assert batcher.pop_batch() == ['a.py', 'b.py']
+    assert batcher.pop_batch() == []
+
+
+def test_regenerate_removes_the_pages_of_deleted_sources(capsys):
+    import optparse
+    outdir = tempfile.mkdtemp()
+    sources = [os.path.join(outdir, name) for name in ('a.py', 'b.py')]
+    for source in sources:
+        with open(source, 'w') as f:
+            f.write(FOO_FUNCTION)
+    opts = optparse.Values({'outdir': outdir, 'paths': False, 'language': None,
+                            'cache_dir': None, 'compress': True,
+                            'page_size': None})
+    p.process(sources, outdir=outdir, preserve_paths=False, compress=True)
+    page = p.destination(sources[1], preserve_paths=False, outdir=outdir)
+    assert os.path.exists(page + '.gz')
+
+    os.remove(sources[1])
+    p.regenerate([sources[1]], opts)
+    assert not os.path.exists(page) and not os.path.exists(page + '.gz')
+    assert list(p.load_search_index(outdir)) == [sources[0]]
+    with open(os.path.join(outdir, 'index.html')) as f:
+        assert 'b.html' not in f.read()
+    assert 'regenerated 0 of 1' in capsys.readouterr()[0]
+
+
+def test_pycco_builder_renders_and_builds():
+    import pycco
+    outdir = tempfile.mkdtemp()
+    docs = pycco.Pycco(outdir=outdir, preserve_paths=False)
+    docs.warm(['python'])
+    docs.clear_caches()
+    assert docs.stats()['lexers'] == 0
+
+    html = docs.render('pycco/compat.py')
+    assert html == p.generate_documentation('pycco/compat.py', outdir=outdir,
+                                            preserve_paths=False).decode('utf-8')
+    assert '<h1>example.py</h1>' in docs.render('# Hello\n' + FOO_FUNCTION,
+                                                name='example.py')
+    assert not os.listdir(outdir)
+
+    results = docs.build(['pycco/compat.py', 'pycco/cache.py'])
+    assert [r.source for r in results] == ['pycco/cache.py', 'pycco/compat.py']
+    assert os.path.exists(os.path.join(outdir, 'compat.html'))
+    assert os.path.exists(os.path.join(outdir, 'index.html'))
+    assert all(r.skipped for r in docs.build(['pycco/compat.py']))
+
+    stats = docs.stats()
+    assert (stats['rendered'], stats['skipped']) == (4, 1)
+    assert stats['markdown_cache'].hits > 0
+    assert stats['lexers'] == 1
+    assert not any(r.skipped for r in docs.build(['pycco/compat.py'], force=True))
+
+    with pytest.raises(ValueError):
+        pycco.Pycco(outdir=outdir, language='non-existent')
+
+
+def test_daemon_renders_requests_and_shuts_down_when_idle(capsys):
+    import optparse
+    import threading
+    from pycco import daemon
+
+    cwd = os.getcwd()
+
+    workdir = tempfile.mkdtemp()
+    socket_path = os.path.join(workdir, 'pycco.sock')
+    with open(os.path.join(workdir, 'example.py'), 'w') as f:
+        f.write(FOO_FUNCTION)
+
+    server = threading.Thread(target=daemon.serve, args=(socket_path, 1))
+    server.start()
+    while not os.path.exists(socket_path):
+        time.sleep(0.01)
+
+    request = {'cwd': workdir, 'source': 'example.py', 'outdir': 'docs'}
+    response = daemon.request(request, socket_path)
+    assert response['destination'] == os.path.join(workdir, 'docs', 'example.html')
+    assert os.path.exists(response['destination'])
+
+    request['write'] = False
+    assert '<title>example.py</title>' in daemon.request(request, socket_path)['html']
+
+    request['source'] = 'missing.py'
+    assert 'error' in daemon.request(request, socket_path)
+
+    # The client forwards --force and builds whole batches.
+    os.chdir(workdir)
+    try:
+        opts = optparse.Values({'outdir': 'docs', 'paths': True, 'language': None,
+                                'cache_dir': None, 'force': False, 'jobs': 1,
+                                'compress': False, 'page_size': None,
+                                'socket': socket_path})
+        assert daemon.client(['example.py'], opts) == []
+        assert 'pycco = example.py' in capsys.readouterr()[0]
+        assert daemon.client(['example.py'], opts) == []
+        assert 'skipped 1' in capsys.readouterr()[0]
+        opts.force = True
+        assert daemon.client(['example.py'], opts) == []
+        assert 'pycco = example.py' in capsys.readouterr()[0]
+
+        # And --page-size.
+        with open('paged.py', 'w') as f:
+            f.write('# One\none = 1\n# Two\ntwo = 2\n')
+        opts.page_size = 1
+        assert daemon.client(['paged.py'], opts) == []
+        assert os.path.exists(os.path.join('docs', 'paged.page-2.html'))
+    finally:
+        os.chdir(cwd)
+
+    server.join(5)
+    assert not server.is_alive()
+    assert not os.path.exists(socket_path)
+
+
+def test_daemon_client_falls_back_for_unfinished_sources():
+    import optparse
+    import socket
+    import threading
+    from pycco import daemon
+
+    socket_path = os.path.join(tempfile.mkdtemp(), 'pycco.sock')
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(socket_path)
+    listener.listen(1)
+
+    requests = []
+
+    def answer(reply):
+        connection = listener.accept()[0]
+        requests.append(json.loads(connection.makefile('rb').readline().decode('utf-8')))
+        connection.sendall(reply)
+        connection.close()
+
+    opts = optparse.Values({'outdir': 'docs', 'paths': True, 'language': None,
+                            'cache_dir': None, 'force': True, 'jobs': 2,
+                            'compress': False, 'page_size': 3,
+                            'socket': socket_path})
+    # A daemon which dies after the first file, or answers nothing at all.
+    for reply, pending in [(b'{"source": "a.py", "destination": "docs/a.html", '
+                            b'"skipped": false}\n{"sour', ['b.py']),
+                           (b'', ['a.py', 'b.py'])]:
+        thread = threading.Thread(target=answer, args=(reply,))
+        thread.start()
+        assert daemon.client(['b.py', 'a.py'], opts) == pending
+        thread.join()
+    listener.close()
+    assert requests[0]['sources'] == ['a.py', 'b.py']
+    assert (requests[0]['force'], requests[0]['jobs']) == (True, 2)
+    assert requests[0]['page_size'] == 3
+
+
+def test_main_client_keeps_the_other_options(monkeypatch, capsys):
+    from pycco import daemon
+    monkeypatch.chdir(tempfile.mkdtemp())
+    handed = []
+    monkeypatch.setattr(daemon, 'client', lambda sources, opts, project=None:
+                        handed.append(sorted(sources)) or [])
+    watched = []
+    monkeypatch.setattr(p, 'monitor', lambda sources, opts, index=None:
+                        watched.append(index))
+
+    def main(*args):
+        monkeypatch.setattr(sys, 'argv', ['pycco', '--client'] + list(args))
+        p.main()
+
+    def git(*args):
+        subprocess.check_call(('git', '-c', 'user.name=pycco',
+                               '-c', 'user.email=pycco@example.com') + args)
+
+    with open('a.py', 'w') as f:
+        f.write('# See [[b.py]].\na = 1\n')
+    with open('b.py', 'w') as f:
+        f.write('b = 1\n')
+    with open('c.py', 'w') as f:
+        f.write('# See [[missing.py]].\nc = 1\n')
+
+    # --strict-links fails before anything is handed to the daemon.
+    with pytest.raises(SystemExit):
+        main('--strict-links', 'a.py', 'c.py')
+    assert handed == []
+
+    # --since only hands it the changed sources.
+    git('init', '-q')
+    git('add', 'a.py', 'b.py')
+    git('commit', '-q', '-m', 'Initial')
+    with open('a.py', 'a') as f:
+        f.write('more = 2\n')
+    main('--since', 'HEAD', 'a.py', 'b.py')
+    assert handed == [['a.py']]
+
+    # --trace and --profile still report, even though the daemon did the work.
+    main('--trace', 'trace.json', '--profile', 'a.py')
+    assert os.path.exists('trace.json')
+    assert 'slowest' in capsys.readouterr()[0].lower()
+
+    # --watch still watches, with an index of the whole project.
+    main('--watch', 'a.py', 'b.py')
+    assert watched[0].lookup('b.py') == 'b.py'
+
+
+def test_benchmark_covers_every_stage():
+    from pycco import benchmark
+    results = benchmark.run(languages=['python'], sizes=['small'], repeat=1)
+    assert sorted(results) == ['python/small/code', 'python/small/comments']
+    for stages in results.values():
+        assert set(stages) == set(benchmark.STAGES)
+
+    baseline = {'python/small/code': {'parse': 1.0, 'highlight': 0.001}}
+    slower = {'python/small/code': {'parse': 2.0, 'highlight': 0.0015}}
+    assert benchmark.compare(slower, baseline) == [('python/small/code', 'parse', 1.0, 2.0)]
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_trace_records_every_stage(jobs):
+    from pycco import trace
+    hooked = []
+    trace.add_hook(hooked.append)
+    trace.start()
+    try:
+        list(p.process_iter([PYCCO_SOURCE, 'pycco/compat.py'],
+                            outdir=tempfile.mkdtemp(), jobs=jobs))
+    finally:
+        tracer = trace.stop()
+        trace.remove_hook(hooked.append)
+
+    names = set(event['name'] for event in tracer.events)
+    assert {'file', 'read', 'parse', 'highlight', 'markdown', 'template', 'write'} <= names
+    assert hooked == tracer.events
+    if jobs > 1:
+        assert os.getpid() not in set(event['pid'] for event in tracer.events)
+
+    summary = tracer.summary()
+    assert summary[0] == 'Slowest files:'
+    assert PYCCO_SOURCE in summary[1] or PYCCO_SOURCE in summary[2]
+
+
+def test_crossref_index_resolves_and_reports_links():
+    outdir = tempfile.gettempdir()
+    index = p.CrossrefIndex(outdir=outdir)
+    index.add('lib/target.py', '# === Link Target ===\nx = 1\n')
+    index.add('lib/user.py', '# See [[target.py#link-target]], [[lib/target.py]],\n'
+                             '# [[target.py#nowhere]] and [[missing.py]].\ny = 2\n')
+
+    assert index.href('target.py') == 'target.html'
+    assert index.href('lib/target.py') == 'target.html'
+    assert index.href('missing.py') is None
+    assert index.broken_links() == [('lib/user.py', 'target.py#nowhere'),
+                                    ('lib/user.py', 'missing.py')]
+
+    comment = p.preprocess('[[target.py#link-target]]', outdir=outdir, index=index)
+    assert comment == ' [target.py](target.html#link-target)'
+
+    index.add('lib/target.py', '# === Nowhere ===\nx = 1\n')
+    assert index.broken_links() == [('lib/user.py', 'target.py#link-target'),
+                                    ('lib/user.py', 'missing.py')]
+
+    index.add('other/target.py', 'x = 2\n')
+    index.remove('lib/target.py')
+    assert index.href('lib/target.py') is None
+    assert index.lookup('target.py') == 'other/target.py'
+
+
+def test_process_paginates_big_files():
+    outdir = tempfile.mkdtemp()
+    long_source = os.path.join(outdir, 'long.py')
+    with open(long_source, 'w') as f:
+        for i in range(10):
+            if i == 8:
+                f.write('# === Deep Down ===\n\nimport os\n\n')
+            f.write('# Comment {0}\nx{0} = {0}\n\n'.format(i))
+    short_source = os.path.join(outdir, 'short.py')
+    with open(short_source, 'w') as f:
+        f.write('# See [[long.py#deep-down]] and [[long.py#section-4]].\nx = 1\n')
+
+    p.process([long_source, short_source], outdir=outdir, preserve_paths=False,
+              page_size=3)
+    pages = [os.path.join(outdir, name) for name in
+             ('long.html', 'long.page-2.html', 'long.page-3.html', 'long.page-4.html')]
+    assert all(os.path.exists(page) for page in pages)
+    with open(pages[2]) as f:
+        html = f.read()
+    assert "id='section-8'" in html and "id='section-5'" not in html
+    assert '<a href="long.html">1</a>' in html and '<strong>3</strong>' in html
+    with open(os.path.join(outdir, 'short.html')) as f:
+        html = f.read()
+    assert 'href="long.page-3.html#deep-down"' in html
+    assert 'href="long.page-2.html#section-4"' in html
+
+    entry = p.load_search_index(outdir)[long_source]
+    assert entry['pages'] == [os.path.basename(page) for page in pages]
+    assert entry['headings'] == [['Deep Down', 'deep-down', 'long.page-3.html']]
+
+    # Moving an anchor to another page renders the pages linking to it again,
+    # even though they did not change.
+    with open(long_source) as f:
+        code = f.read()
+    heading = '# === Deep Down ===\n\nimport os\n\n'
+    with open(long_source, 'w') as f:
+        f.write(heading + code.replace(heading, ''))
+    p.process([long_source, short_source], outdir=outdir, preserve_paths=False,
+              page_size=3, compress=True)
+    with open(os.path.join(outdir, 'short.html')) as f:
+        assert 'href="long.html#deep-down"' in f.read()
+    assert all(os.path.exists(page + '.gz') for page in pages)
+
+    # Pages a file no longer has go away, with their compressed copies.
+    p.process([long_source], outdir=outdir, preserve_paths=False, page_size=5)
+    assert [os.path.exists(page) for page in pages] == [True, True, True, False]
+    assert not os.path.exists(pages[3] + '.gz')
+    p.process([long_source], outdir=outdir, preserve_paths=False)
+    assert [os.path.exists(page) for page in pages] == [True, False, False, False]
+
+
+def test_process_writes_project_index():
+    outdir = tempfile.mkdtemp()
+    source = os.path.join(outdir, 'example.py')
+    with open(source, 'w') as f:
+        f.write('# === Usage ===\n' + FOO_FUNCTION +
+                '\n\n# ## The `bar` function\n#\n#     # Not a heading\n#\n'
+                '# Notes\n# -----\ndef bar():\n    pass\n')
+    p.process([source, 'pycco/compat.py'], outdir=outdir)
+
+    with open(os.path.join(outdir, p.SEARCH_INDEX_NAME)) as f:
+        entries = dict((e['source'], e) for e in json.load(f)['files'])
+    assert entries[source]['url'] == 'example.html'
+    assert entries[source]['headings'] == [['Usage', 'usage'],
+                                           ['The bar function', None],
+                                           ['Notes', None]]
+    assert entries[source]['identifiers'] == ['bar', 'foo']
+
+    with open(os.path.join(outdir, 'index.html')) as f:
+        index = f.read()
+    assert 'href="example.html"' in index
+    assert 'href="pycco/compat.html"' in index
+
+    # Skipped files keep their place in the index.
+    p.process([source], outdir=outdir)
+    with open(os.path.join(outdir, p.SEARCH_INDEX_NAME)) as f:
+        assert len(json.load(f)['files']) == 2
+
+
+def test_since_builds_only_what_git_reports_changed(monkeypatch):
+    from pycco import vcs
+    repo = tempfile.mkdtemp()
+    monkeypatch.chdir(repo)
+
+    def git(*args):
+        subprocess.check_call(('git', '-c', 'user.name=pycco',
+                               '-c', 'user.email=pycco@example.com') + args)
+
+    git('init', '-q')
+    with open('.gitignore', 'w') as f:
+        f.write('docs/\n')
+    for name in ('deleted', 'moved', 'modified', 'same'):
+        with open(name + '.py', 'w') as f:
+            f.write('# The {} module.\n{} = 1\n'.format(name, name))
+    git('add', '.')
+    git('commit', '-q', '-m', 'Initial')
+    sources = ['deleted.py', 'modified.py', 'moved.py', 'same.py']
+    p.process(sources, outdir='docs', compress=True)
+
+    git('rm', '-q', 'deleted.py')
+    git('mv', 'moved.py', 'renamed.py')
+    with open('modified.py', 'a') as f:
+        f.write('more = 2\n')
+    with open('added.py', 'w') as f:
+        f.write('added = 1\n')
+
+    changes = vcs.changes_since('HEAD')
+    assert sorted(changes.changed) == ['added.py', 'modified.py', 'renamed.py']
+    assert changes.deleted == ['deleted.py']
+    assert changes.renamed == [('moved.py', 'renamed.py')]
+
+    index = p.CrossrefIndex(outdir='docs')
+    index.add('deleted.py', 'deleted = 1\n')
+    index.add('moved.py', 'moved = 1\n')
+    sources = ['added.py', 'modified.py', 'renamed.py', 'same.py']
+    assert vcs.prepare_build(changes, sources, 'docs', compress=True, index=index) \
+        == ['added.py', 'modified.py', 'renamed.py']
+    assert index.lookup('deleted.py') is None and index.lookup('moved.py') is None
+    assert sorted(os.listdir('docs')) == sorted([
+        p.MANIFEST_NAME, p.SEARCH_INDEX_NAME, p.SEARCH_INDEX_NAME + '.gz',
+        'index.html', 'index.html.gz', 'pycco-etags.json',
+        p.stylesheet_name(), p.stylesheet_name() + '.gz',
+        p.STYLESHEET_NAME, p.STYLESHEET_NAME + '.gz',
+        'modified.html', 'modified.html.gz', 'renamed.html', 'renamed.html.gz',
+        'same.html', 'same.html.gz'])
+    with open(os.path.join('docs', 'index.html')) as f:
+        assert 'deleted.html' not in f.read()
+
+    with pytest.raises(ValueError):
+        vcs.changes_since('no-such-revision')
+
+
+def test_project_index_is_sharded_for_big_trees(monkeypatch):
+    monkeypatch.setattr(p, 'INDEX_PAGE_SIZE', 1)
+    outdir = tempfile.mkdtemp()
+    entries = {
+        'a/x.py': {'source': 'a/x.py', 'url': 'x.html', 'title': 'x.py'},
+        'b/y.py': {'source': 'b/y.py', 'url': 'y.html', 'title': 'y.py'},
+        'a-b/z.py': {'source': 'a-b/z.py', 'url': 'z.html', 'title': 'z.py'},
+        'a/b/w.py': {'source': 'a/b/w.py', 'url': 'w.html', 'title': 'w.py'},
+    }
+    p.write_project_index(outdir, entries)
+    with open(os.path.join(outdir, 'index.html')) as f:
+        index = f.read()
+    assert 'href="{}"'.format(p.index_page_name('a')) in index
+    assert 'x.html' not in index
+    with open(os.path.join(outdir, p.index_page_name('b'))) as f:
+        assert 'href="y.html"' in f.read()
+
+    # Directories whose names look alike still get pages of their own.
+    assert p.index_page_name('a/b') != p.index_page_name('a-b')
+    with open(os.path.join(outdir, p.index_page_name('a/b'))) as f:
+        assert 'href="w.html"' in f.read()
+    with open(os.path.join(outdir, p.index_page_name('a-b'))) as f:
+        assert 'href="z.html"' in f.read()
+
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+# Memory is measured with tracemalloc, which Python 2 does not have.
+needs_tracemalloc = pytest.mark.skipif(tracemalloc is None,
+                                       reason='tracemalloc needs Python 3.4+')
+
+
+def peak_memory(func):
+    """The most memory `func()` had allocated at once, in bytes."""
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+LANGUAGE_NAMES = sorted(p.languages_by_name)
+
+# Each timing compares an input with one ten times bigger. Linear work takes
+# about ten times as long; anything quadratic takes about a hundred times.
+GROWTH_LIMIT = 20
+
+# The tests below take a couple of minutes over every language, so they only
+# run with `py.test --perf`.
+perf = pytest.mark.perf
+
+
+@perf
+@pytest.mark.parametrize('name', LANGUAGE_NAMES)
+def test_parse_scales_linearly(name):
+    from pycco import benchmark
+    language = p.languages_by_name[name]
+    small = benchmark.generate_source(language, 10000)
+    big = benchmark.generate_source(language, 100000)
+
+    # The best of several runs leaves out the noise of a busy machine.
+    t_small = benchmark.best_time(lambda: p.parse(small, language), 5)
+    t_big = benchmark.best_time(lambda: p.parse(big, language), 5)
+    assert t_big < GROWTH_LIMIT * t_small
+
+
+@perf
+@needs_tracemalloc
+@pytest.mark.parametrize('name', LANGUAGE_NAMES)
+def test_parse_memory_is_bounded(name):
+    from pycco import benchmark
+    language = p.languages_by_name[name]
+    big = benchmark.generate_source(language, 100000)
+
+    # The sections hold the source about once over, plus their objects.
+    assert peak_memory(lambda: p.parse(big, language)) < 6 * len(big)
+
+
+@perf
+@pytest.mark.parametrize('name', LANGUAGE_NAMES)
+def test_highlight_scales_linearly(name):
+    from pycco import benchmark
+    language = p.languages_by_name[name]
+    outdir = tempfile.mkdtemp()
+
+    def highlight(code):
+        sections = p.parse(code, language)
+
+        def run():
+            p.markdown_cache.clear()
+            p.highlight(sections, language, outdir=outdir)
+        return run
+
+    t_small = benchmark.best_time(highlight(benchmark.generate_source(language, 1000)), 3)
+    t_big = benchmark.best_time(highlight(benchmark.generate_source(language, 10000)), 3)
+    assert t_big < GROWTH_LIMIT * t_small
+
+
+@perf
+@needs_tracemalloc
+@pytest.mark.parametrize('name', LANGUAGE_NAMES)
+def test_generate_documentation_memory_is_bounded(name):
+    from pycco import benchmark
+    language = p.languages_by_name[name]
+    outdir = tempfile.mkdtemp()
+    source = 'big' + benchmark.extension(language)
+    # Load the lexer, template and Markdown first, so that only the page is
+    # measured.
+    p._generate_documentation(source, benchmark.generate_source(language, 10),
+                              outdir, True, name)
+
+    code = benchmark.generate_source(language, 5000)
+    p.markdown_cache.clear()
+    peak = peak_memory(lambda: p._generate_documentation(source, code, outdir,
+                                                         True, name))
+    # Highlighted code takes several times the size of the source; about 30
+    # times at most, for the languages whose code Pygments marks up most.
+    assert peak < 48 * len(code)
+
+
+@needs_tracemalloc
+def test_streaming_memory_stays_flat(monkeypatch):
+    from pycco import benchmark, stream
+    monkeypatch.setattr(p, 'STREAM_CHUNK_SIZE', 16 * 1024)
+    monkeypatch.setattr(p, 'STREAM_SECTION_SIZE', 16 * 1024)
+    language = p.languages_by_name['python']
+    workdir = tempfile.mkdtemp()
+    outdir = os.path.join(workdir, 'docs')
+
+    def document(lines, comments=True):
+        source = os.path.join(workdir, 'big{}{}.py'.format(lines, comments))
+        with open(source, 'w') as f:
+            if comments:
+                f.write(benchmark.generate_source(language, lines))
+            else:
+                f.write(''.join('value_{0} = compute({0})\n'.format(i)
+                                for i in range(lines)))
+        stream.stream_documentation(source, outdir=outdir)
+        p.markdown_cache.clear()
+        return peak_memory(lambda: stream.stream_documentation(source, outdir=outdir))
+
+    # Rendered in memory, five times the source would take about five times
+    # the memory; streamed, only the search entry grows. Without any comments
+    # the whole source would make up a single section, unless it is cut.
+    assert document(2500) < 2 * document(500)
+    assert document(5000, comments=False) < 2 * document(1000, comments=False)